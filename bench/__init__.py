@@ -0,0 +1 @@
+"""Offline load benchmarks: the real cogs against a simulated guild and REST API, see simulator.py."""
@@ -0,0 +1,73 @@
+"""Run the offline load scenarios and print the results as JSON.
+
+    python -m bench [scenario ...] [--set name=value ...] [--latency S] [--time-scale X] [--seed N] [--out FILE]
+
+With no scenarios named every one is run. ``--set`` overrides a scenario
+argument (see bench/scenarios.py), ``--latency`` adds a fixed delay to every
+fake API call and ``--time-scale`` shrinks the rate limit windows.
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import platform
+import subprocess
+import sys
+import discord
+from bench.scenarios import SCENARIOS
+from bench.simulator import REPO, Simulator
+
+
+def scenario_params(scenario, overrides):
+    params = {name: parameter.default for name, parameter in inspect.signature(scenario).parameters.items() if parameter.default is not inspect.Parameter.empty}
+    for name, value in overrides.items():
+        if name in params:
+            params[name] = type(params[name])(value)
+    return params
+
+
+async def run(name, params, args):
+    sim = Simulator(args.latency, args.time_scale, args.seed)
+    try:
+        result = await SCENARIOS[name](sim, **params)
+        return dict({"scenario": name, "params": params, "result": result}, **sim.report())
+    finally:
+        await sim.close()
+
+
+def commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m bench", description="Offline load benchmarks for the cogs")
+    parser.add_argument("scenarios", nargs="*", choices=[[]] + list(SCENARIOS), help="scenarios to run, all of them by default")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE", help="override a scenario argument")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every API call")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="multiplier for rate limit windows")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="also write the results to this file")
+    args = parser.parse_args()
+    overrides = dict(item.split("=", 1) for item in args.set)
+
+    #The cogs print and warn freely, keep stdout for the results
+    stdout, sys.stdout = sys.stdout, sys.stderr
+    results = []
+    for name in args.scenarios or SCENARIOS:
+        print(f"Running {name}", file=sys.stderr)
+        results.append(asyncio.run(run(name, scenario_params(SCENARIOS[name], overrides), args)))
+    sys.stdout = stdout
+
+    report = {"commit": commit(), "python": platform.python_version(), "discord.py": discord.__version__, "results": results}
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.out:
+        with open(args.out, "w") as file:
+            file.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import asyncio
+import json
+import time
+from collections import Counter, defaultdict
+from utils.ratelimit import RateLimitWatcher
+
+#Per-bucket limits as (requests, per seconds), roughly what Discord hands out
+ROUTE_LIMITS = {
+    "POST /channels/{channel_id}/messages": (5, 5),
+    "POST /channels/{channel_id}/messages/bulk_delete": (1, 1),
+    "DELETE /channels/{channel_id}/messages/{message_id}": (5, 1),
+    "PUT /channels/{channel_id}/messages/{message_id}/reactions/{emoji}/@me": (1, 0.25),
+    "DELETE /channels/{channel_id}/messages/{message_id}/reactions/{emoji}/{member_id}": (1, 0.25),
+    "PUT /guilds/{guild_id}/members/{user_id}/roles/{role_id}": (10, 10),
+    "DELETE /guilds/{guild_id}/members/{user_id}/roles/{role_id}": (10, 10),
+    "PATCH /guilds/{guild_id}/members/{user_id}": (10, 10),
+    "PATCH /channels/{channel_id}": (2, 600),
+}
+DEFAULT_LIMIT = (50, 1)
+GLOBAL_LIMIT = (50, 1)
+
+
+class Bucket:
+    __slots__ = ("remaining", "reset")
+
+    def __init__(self, limit, reset):
+        self.remaining = limit
+        self.reset = reset
+
+
+class FakeHTTP:
+    """Stands in for ``HTTPClient.request``.
+
+    Every call is counted per route and held to a fixed-window limit per
+    bucket plus a global one. Like discord.py, calls on one bucket take turns
+    and a call finding the bucket empty waits for the window to reset. The
+    wait is passed to the RateLimitWatcher as if Discord's headers had
+    reported it, so RateLimiters and metrics see it. Responses and the
+    gateway events that follow them come from the simulator.
+    ``latency`` is added to every call, ``time_scale`` shrinks the windows.
+    """
+
+    def __init__(self, simulator, latency=0.0, time_scale=1.0):
+        self.simulator = simulator
+        self.latency = latency
+        self.time_scale = time_scale
+        self.buckets = {}
+        self.locks = defaultdict(asyncio.Lock)
+        self.calls = Counter()
+        self.rate_limited = Counter()
+        self.waited = 0.0
+        self.inflight = 0
+
+    def bucket(self, key, limit, per):
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None or bucket.reset <= now:
+            bucket = self.buckets[key] = Bucket(limit, now + per * self.time_scale)
+        return bucket
+
+    async def request(self, route, *, files=None, form=None, **kwargs):
+        name = f"{route.method} {route.path}"
+        limit, per = ROUTE_LIMITS.get(name, DEFAULT_LIMIT)
+        key = f"{route.method} {route.bucket}"
+        self.inflight += 1
+        try:
+            async with self.locks[key]:
+                while True:
+                    bucket, global_bucket = self.bucket(key, limit, per), self.bucket("global", *GLOBAL_LIMIT)
+                    if bucket.remaining and global_bucket.remaining:
+                        bucket.remaining -= 1
+                        global_bucket.remaining -= 1
+                        break
+                    if not global_bucket.remaining:
+                        wait = global_bucket.reset - time.monotonic()
+                        RateLimitWatcher.emit("global", None, wait)
+                    else:
+                        wait = bucket.reset - time.monotonic()
+                        RateLimitWatcher.emit("exhausted", route.bucket, wait)
+                    self.rate_limited[name] += 1
+                    self.waited += wait
+                    await asyncio.sleep(wait)
+            self.calls[name] += 1
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            payload = kwargs.get("json")
+            if form:
+                #send_files puts the message itself in a payload_json form field
+                payload = next((json.loads(field["value"]) for field in form if field["name"] == "payload_json"), {})
+            return self.simulator.respond(route, payload, kwargs.get("params") or {})
+        finally:
+            self.inflight -= 1
@@ -0,0 +1,151 @@
+import asyncio
+import itertools
+import json
+import os
+from bench.simulator import BOT_ID, REPO
+
+#Common words that nobody highlights, padded around the interesting ones
+FILLER = ("the", "a", "is", "and", "to", "of", "it", "on", "for", "this", "that", "with", "i", "you", "what", "when", "lol", "anyone", "know", "how")
+
+
+def sentence(rng, length, vocabulary=(), hit_rate=0.0):
+    words = [rng.choice(FILLER) for _ in range(length)]
+    if vocabulary and rng.random() < hit_rate:
+        words[rng.randrange(length)] = rng.choice(vocabulary)
+    return " ".join(words)
+
+
+async def highlights(sim, subscribers=10000, words=3, vocabulary=5000, messages=2000, rate=0, length=12, hit_rate=0.3):
+    """Messages in a busy channel while ``subscribers`` members each highlight ``words`` words."""
+    members = [sim.add_member(f"user{number}") for number in range(subscribers)]
+    channel = sim.add_channel("general")
+    await sim.start(["highlights", "logs"])
+    cog = sim.client.get_cog("Highlights")
+    await cog.loaded
+
+    #Filled in directly, going through add_word would queue a storage write for every word
+    vocabulary = [f"word{number}" for number in range(vocabulary)]
+    for member_id in members:
+        cog.highlight_data[str(member_id)] = sim.rng.sample(vocabulary, words)
+    cog.build_index()
+
+    sim.reset()
+    await sim.feed((lambda: sim.message(channel, sim.rng.choice(members), sentence(sim.rng, length, vocabulary, hit_rate)) for _ in range(messages)), rate)
+    await sim.settle()
+    return {
+        "highlighted_words": len(cog.highlight_index),
+        "dms_queued": cog.dm_queue.queued,
+        "dms_pending": len(cog.dm_queue.pending),
+        "dms_dropped": cog.dm_queue.dropped,
+        "context_hits": cog.context_hits,
+        "context_misses": cog.context_misses,
+    }
+
+
+async def reaction_rush(sim, users=500, rate=0, switch=0.2, invalid=0.05):
+    """``users`` members pick from an exclusive reaction role menu at once, some change their mind."""
+    with open(os.path.join(REPO, "data/reaction_roles_data.json")) as file:
+        menus = json.load(file)
+    #The exclusive menu with the most options
+    message_id, menu = max(((int(message_id), menu) for message_id, menu in menus.items() if not menu["multiple"]), key=lambda item: len(item[1]))
+    options = [emoji_name for emoji_name in menu if emoji_name != "multiple"]
+    for emoji_name in options:
+        sim.add_role(emoji_name, menu[emoji_name])
+        sim.add_emoji(emoji_name)
+    sim.add_emoji("not_on_the_menu")
+    members = [sim.add_member(f"user{number}") for number in range(users)]
+    channel = sim.add_channel("roles")
+    await sim.start(["roles", "rules", "general", "admin"])
+
+    picks = []
+    changes = []
+    for member_id in members:
+        picks.append((member_id, "not_on_the_menu" if sim.rng.random() < invalid else sim.rng.choice(options)))
+        if sim.rng.random() < switch:
+            changes.append((member_id, sim.rng.choice(options)))
+    sim.reset()
+    await sim.feed((lambda pick=pick: sim.react(channel, message_id, *pick) for pick in picks + changes), rate)
+    await sim.settle()
+
+    menu_roles = {str(menu[emoji_name]) for emoji_name in options}
+    held = [len(menu_roles.intersection(sim.members[member_id]["roles"])) for member_id in members]
+    return {
+        "menu": message_id,
+        "changes": len(changes),
+        "members_with_a_role": sum(1 for count in held if count == 1),
+        "members_with_several_roles": sum(1 for count in held if count > 1),
+    }
+
+
+async def bulk_purge(sim, messages=1000, amount=500, authors=20, length=12, filters=""):
+    """An admin clears ``amount`` messages from a channel holding ``messages``, optionally with .clearchat filters."""
+    admin = sim.add_member("admin", roles=[sim.role_id("Committee")])
+    members = [sim.add_member(f"user{number}") for number in range(authors)]
+    channel = sim.add_channel("general")
+    await sim.start(["admin", "logs", "errors"])
+    await sim.feed(lambda: sim.message(channel, sim.rng.choice(members), sentence(sim.rng, length)) for _ in range(messages))
+    await sim.settle()
+
+    sim.reset()
+    sim.message(channel, admin, f".clearchat {amount} {filters}".strip())
+    await sim.settle()
+    await sim.client.logSink.flush()
+    await sim.settle()
+    return {
+        "messages_left": len(sim.history[channel]) - 1,
+        "log_messages_sent": sim.client.logSink.sent,
+    }
+
+
+async def mixed(sim, members=1000, duration=10, messages=50, edits=5, deletes=5, reactions=10, joins=1, length=12):
+    """Everyday traffic for ``duration`` seconds, the other arguments are events per second."""
+    with open(os.path.join(REPO, "data/reaction_roles_data.json")) as file:
+        menus = json.load(file)
+    message_id, menu = next((int(message_id), menu) for message_id, menu in menus.items())
+    options = [emoji_name for emoji_name in menu if emoji_name != "multiple"]
+    for emoji_name in options:
+        sim.add_role(emoji_name, menu[emoji_name])
+        sim.add_emoji(emoji_name)
+    member_ids = [sim.add_member(f"user{number}") for number in range(members)]
+    channels = [sim.add_channel(f"channel{number}") for number in range(5)]
+    await sim.start()
+    highlighter = sim.client.get_cog("Highlights")
+    await highlighter.loaded
+    for member_id in member_ids[:members // 10]:
+        highlighter.highlight_data[str(member_id)] = [sim.rng.choice(("exam", "deadline", "pizza", "lecture"))]
+    highlighter.build_index()
+
+    def own_message():
+        #Edits and deletes go to recent messages sent by users rather than the bot
+        recent = [message for message in list(sim.messages)[-50:] if int(sim.messages[message]["author"]["id"]) != BOT_ID]
+        return sim.rng.choice(recent) if recent else None
+
+    def edit():
+        message = own_message()
+        if message is not None:
+            sim.edit(message, sentence(sim.rng, length, ("exam", "deadline"), 0.2))
+
+    def delete():
+        message = own_message()
+        if message is not None:
+            sim.delete(message)
+
+    sim.reset()
+    streams = (
+        (messages, lambda: sim.message(sim.rng.choice(channels), sim.rng.choice(member_ids), sentence(sim.rng, length, ("exam", "deadline", "pizza", "lecture"), 0.1))),
+        (edits, edit),
+        (deletes, delete),
+        (reactions, lambda: sim.react(channels[0], message_id, sim.rng.choice(member_ids), sim.rng.choice(options))),
+        (joins, lambda: sim.add_member("newcomer")),
+    )
+    await asyncio.gather(*(sim.feed(itertools.repeat(event, int(rate * duration)), rate) for rate, event in streams if rate))
+    await sim.settle()
+    return {}
+
+
+SCENARIOS = {
+    "highlights": highlights,
+    "reaction_rush": reaction_rush,
+    "bulk_purge": bulk_purge,
+    "mixed": mixed,
+}
@@ -0,0 +1,404 @@
+import asyncio
+import datetime
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+from collections import Counter, defaultdict
+from urllib.parse import unquote
+import discord
+from discord.ext import commands
+from discord.http import Route
+from discord.user import ClientUser
+from discord.utils import time_snowflake
+from bench.fake_http import FakeHTTP
+from utils.channel_status import ChannelStatusWriter
+from utils.dispatch import MessageRouter
+from utils.extensions import load_timed
+from utils.log_sink import LogSink
+from utils.message_cache import MessageCache
+from utils.metrics import Metrics
+from utils.ratelimit import RateLimitWatcher
+from utils.storage import Storage
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+#Cogs that reach out to other services as soon as they load
+SKIP_COGS = ("adventofcode", "covid")
+#The channels bot.py resolves at startup
+CHANNELS = {
+    "botLogChannel": 814152479100633128,
+    "botCommandChannel": 517651663729852416,
+    "roomChannel": 892436503890915438,
+}
+#Other channels and roles the cogs look up
+SERVER_CHANNELS = {
+    "arrivals": 783388268631818280,
+    "self-roles": 785558941688922152,
+    "rules": 804817413841354843,
+}
+SERVER_ROLES = ("Announcement", "Committee", "DevSoc Elders", "Trainee Committee", "Server Muted",
+                "First Year", "Second Year", "Third Year", "Placement Year", "Fourth Year", "Alumni", "Placement")
+GUILD_ID = 206351865754025984
+BOT_ID = 1
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    def rank(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+    return {"count": len(ordered), "p50": round(rank(0.5), 3), "p99": round(rank(0.99), 3), "max": round(ordered[-1] * 1000, 3)}
+
+
+class Simulator:
+    """Runs the real cogs against a fake guild with no connection to Discord.
+
+    The guild, its members and channels are kept here as gateway payloads.
+    Events are fed through discord.py's own gateway parsers, so the cogs
+    receive the same objects they would in production, and every REST call
+    goes through ``FakeHTTP``. Discord's side effects come back as gateway
+    events, counted separately: a sent message is echoed back, a bulk delete
+    fires MESSAGE_DELETE_BULK, a role change fires GUILD_MEMBER_UPDATE. The
+    cogs run in a scratch copy of data/ so nothing in the repo is written.
+
+    Add members, roles, channels and emojis before ``start``, call ``reset``
+    before the part being measured and ``settle`` after it.
+    """
+
+    def __init__(self, latency=0.0, time_scale=1.0, seed=0):
+        self.latency = latency
+        self.time_scale = time_scale
+        self.rng = random.Random(seed)
+        self.client = None
+        self.last_id = 0
+
+        self.roles = {}
+        self.channels = {}
+        self.emojis = {}
+        #Member ID -> member payload, which is Discord's view of their roles
+        self.members = {}
+        self.messages = {}
+        #Channel ID -> message IDs, oldest first
+        self.history = defaultdict(list)
+        self.dm_channels = {}
+
+        self.bot = self.user_payload(BOT_ID, "DevBot", bot=True)
+        self.add_role("@everyone", GUILD_ID)
+        self.members[BOT_ID] = self.member_payload(self.bot, [])
+        for name, channel_id in dict(CHANNELS, **SERVER_CHANNELS).items():
+            self.add_channel(name, channel_id)
+        for name in SERVER_ROLES:
+            self.add_role(name)
+
+        self.http = FakeHTTP(self, latency, time_scale)
+        self.samples = defaultdict(list)
+        self.events = Counter()
+        self.echoed = Counter()
+        self.inflight = 0
+        self.started = self.finished = time.perf_counter()
+
+    def next_id(self):
+        self.last_id = max(self.last_id + 1, time_snowflake(datetime.datetime.utcnow()))
+        return self.last_id
+
+    def now(self):
+        return datetime.datetime.utcnow().isoformat()
+
+    def user_payload(self, user_id, name, bot=False):
+        return {"id": str(user_id), "username": name, "discriminator": "0001", "avatar": None, "bot": bot}
+
+    def member_payload(self, user, roles):
+        return {"user": user, "roles": [str(role_id) for role_id in roles], "joined_at": self.now(), "nick": None, "deaf": False, "mute": False}
+
+    def add_role(self, name, role_id=None):
+        role_id = role_id or self.next_id()
+        self.roles[role_id] = {"id": str(role_id), "name": name, "permissions": "0", "position": len(self.roles), "color": 0, "hoist": False, "managed": False, "mentionable": False}
+        return role_id
+
+    def role_id(self, name):
+        return next(role_id for role_id, role in self.roles.items() if role["name"] == name)
+
+    def add_channel(self, name, channel_id=None):
+        channel_id = channel_id or self.next_id()
+        self.channels[channel_id] = {"id": str(channel_id), "type": 0, "name": name, "position": len(self.channels), "permission_overwrites": [], "guild_id": str(GUILD_ID)}
+        return channel_id
+
+    def add_emoji(self, name, emoji_id=None):
+        emoji_id = emoji_id or self.next_id()
+        self.emojis[name] = {"id": str(emoji_id), "name": name, "roles": [], "require_colons": True, "managed": False, "animated": False, "available": True}
+        return emoji_id
+
+    def add_member(self, name, roles=()):
+        """Add a member to the guild, firing GUILD_MEMBER_ADD if the bot is already running."""
+        member_id = self.next_id()
+        member = self.members[member_id] = self.member_payload(self.user_payload(member_id, name), roles)
+        if self.client is not None:
+            self.gateway("GUILD_MEMBER_ADD", dict(member, guild_id=str(GUILD_ID)))
+        return member_id
+
+    async def start(self, cogs=None):
+        """Build the client the way bot.py does and load the cogs into it."""
+        self.workdir = tempfile.mkdtemp(prefix="devbot-bench-")
+        shutil.copytree(os.path.join(REPO, "data"), os.path.join(self.workdir, "data"))
+        self.cwd = os.getcwd()
+        os.chdir(self.workdir)
+
+        intents = discord.Intents.default()
+        intents.members = True
+        intents.presences = True
+        client = self.client = commands.Bot(command_prefix=".", owner_id=BOT_ID, loop=asyncio.get_running_loop(), intents=intents)
+        client.remove_command('help')
+        client.http.request = self.http.request
+        client.metrics = Metrics()
+        client.metrics.install(client)
+        RateLimitWatcher.install(client)
+        client.router = MessageRouter(client, client.command_prefix)
+        client.add_listener(client.router.on_message)
+        client.add_listener(client.router.on_message_edit)
+        client.channelsReady = asyncio.Event()
+        client.logSink = LogSink(client, lambda: getattr(client, "botLogChannel", None), ready=client.channelsReady)
+        client.messageCache = MessageCache(10000, 7 * 24 * 3600)
+        client.purgedMessages = set()
+        client.channelStatus = ChannelStatusWriter(client)
+        client.storage = Storage("data/devbot.db", log=client.logSink.send)
+        client.cogTimings = {}
+        client.cogHashes = {}
+        client.cogState = {}
+
+        #Keep every observation the metrics layer makes, for exact percentiles
+        observe = client.metrics.observe
+        def record(kind, name, seconds, error=False):
+            self.samples[kind, name].append(seconds)
+            observe(kind, name, seconds, error)
+        client.metrics.observe = record
+
+        #Count listener runs from the moment they are scheduled, so settle() can tell when all are done
+        run_event = client._run_event
+        def tracked_run_event(coro, event_name, *args, **kwargs):
+            self.inflight += 1
+            return self.finish_event(run_event(coro, event_name, *args, **kwargs))
+        client._run_event = tracked_run_event
+
+        state = client._connection
+        state.is_bot = True
+        state.user = ClientUser(state=state, data=self.bot)
+        self.guild = state._add_guild_from_data({
+            "id": str(GUILD_ID),
+            "name": "DevSoc",
+            "owner_id": str(BOT_ID),
+            "member_count": len(self.members),
+            "roles": list(self.roles.values()),
+            "channels": list(self.channels.values()),
+            "emojis": list(self.emojis.values()),
+            "members": list(self.members.values()),
+        })
+        for name, channel_id in CHANNELS.items():
+            setattr(client, name, self.guild.get_channel(channel_id))
+        client.channelsReady.set()
+        client._ready.set()
+
+        for filename in sorted(os.listdir(os.path.join(REPO, "cogs"))):
+            name = filename[:-3]
+            if filename.endswith(".py") and name not in SKIP_COGS and (cogs is None or name in cogs):
+                load_timed(client, f"cogs.{name}")
+        client.logSink.start()
+        await self.settle()
+
+    async def finish_event(self, coro):
+        try:
+            await coro
+        finally:
+            self.inflight -= 1
+
+    async def close(self):
+        if self.client is not None:
+            for name in list(self.client.extensions):
+                self.client.unload_extension(name)
+            self.client._closed = True
+            for task in asyncio.all_tasks():
+                if task is not asyncio.current_task():
+                    task.cancel()
+            await asyncio.sleep(0)
+            self.client.storage.close()
+            os.chdir(self.cwd)
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def reset(self):
+        """Forget everything recorded so far and start the clock."""
+        self.samples.clear()
+        self.events.clear()
+        self.echoed.clear()
+        self.http.calls.clear()
+        self.http.rate_limited.clear()
+        self.http.waited = 0.0
+        self.client.metrics.reset()
+        self.started = time.perf_counter()
+
+    async def settle(self):
+        """Wait until no listener is running and no API call is in flight."""
+        idle = 0
+        while idle < 3:
+            busy = self.inflight or self.http.inflight
+            await asyncio.sleep(0.005 if busy else 0)
+            idle = 0 if busy else idle + 1
+        self.finished = time.perf_counter()
+
+    async def feed(self, events, rate=0):
+        """Call each event in turn, ``rate`` per second or as fast as possible if 0."""
+        start = time.perf_counter()
+        for count, event in enumerate(events, 1):
+            event()
+            if rate:
+                delay = start + count / rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif count % 100 == 0:
+                await asyncio.sleep(0)
+
+    def gateway(self, event, data, echo=False):
+        (self.echoed if echo else self.events)[event] += 1
+        self.client._connection.parsers[event](data)
+
+    #Events from users
+
+    def message(self, channel_id, author_id, content, embeds=(), echo=False):
+        message_id = self.next_id()
+        author = self.members[author_id]
+        data = self.messages[message_id] = {
+            "id": str(message_id), "channel_id": str(channel_id), "guild_id": str(GUILD_ID),
+            "author": author["user"], "member": {key: value for key, value in author.items() if key != "user"},
+            "content": content, "timestamp": self.now(), "edited_timestamp": None, "tts": False,
+            "mention_everyone": False, "mentions": [], "mention_roles": [], "attachments": [], "embeds": list(embeds),
+            "pinned": False, "type": 0,
+        }
+        self.history[channel_id].append(message_id)
+        self.gateway("MESSAGE_CREATE", data, echo)
+        return message_id
+
+    def edit(self, message_id, content):
+        data = self.messages[message_id]
+        data["content"], data["edited_timestamp"] = content, self.now()
+        self.gateway("MESSAGE_UPDATE", {key: data[key] for key in ("id", "channel_id", "guild_id", "content", "edited_timestamp")})
+
+    def delete(self, message_id, echo=False):
+        data = self.messages.pop(message_id)
+        self.history[int(data["channel_id"])].remove(message_id)
+        self.gateway("MESSAGE_DELETE", {"id": data["id"], "channel_id": data["channel_id"], "guild_id": str(GUILD_ID)}, echo)
+
+    def bulk_delete(self, channel_id, message_ids, echo=False):
+        message_ids = set(message_ids)
+        for message_id in message_ids:
+            self.messages.pop(message_id, None)
+        self.history[channel_id] = [message_id for message_id in self.history[channel_id] if message_id not in message_ids]
+        self.gateway("MESSAGE_DELETE_BULK", {"ids": [str(message_id) for message_id in message_ids], "channel_id": str(channel_id), "guild_id": str(GUILD_ID)}, echo)
+
+    def react(self, channel_id, message_id, user_id, emoji_name, add=True, echo=False):
+        emoji = self.emojis[emoji_name]
+        data = {
+            "user_id": str(user_id), "channel_id": str(channel_id), "message_id": str(message_id), "guild_id": str(GUILD_ID),
+            "emoji": {"id": emoji["id"], "name": emoji_name, "animated": False},
+        }
+        if add:
+            data["member"] = self.members[user_id]
+        self.gateway("MESSAGE_REACTION_ADD" if add else "MESSAGE_REACTION_REMOVE", data, echo)
+
+    def set_roles(self, member_id, roles):
+        member = self.members[member_id]
+        member["roles"] = [str(role_id) for role_id in roles]
+        self.gateway("GUILD_MEMBER_UPDATE", dict(member, guild_id=str(GUILD_ID)), echo=True)
+        return member
+
+    #Discord's side of the REST API
+
+    def respond(self, route, payload, query):
+        args = route_args(route)
+        endpoint = f"{route.method} {route.path}"
+        channel_id = int(args.get("channel_id", 0))
+
+        if endpoint == "POST /channels/{channel_id}/messages":
+            return self.bot_message(channel_id, payload or {})
+        if endpoint == "GET /channels/{channel_id}/messages":
+            return self.fetch_history(channel_id, query)
+        if endpoint == "POST /channels/{channel_id}/messages/bulk_delete":
+            self.bulk_delete(channel_id, [int(message_id) for message_id in payload["messages"]], echo=True)
+            return None
+        if endpoint == "DELETE /channels/{channel_id}/messages/{message_id}":
+            if int(args["message_id"]) in self.messages:
+                self.delete(int(args["message_id"]), echo=True)
+            return None
+        if endpoint == "POST /users/@me/channels":
+            dm_id = self.next_id()
+            self.dm_channels[dm_id] = int(payload["recipient_id"])
+            return {"id": str(dm_id), "type": 1, "recipients": [self.members[int(payload["recipient_id"])]["user"]]}
+        if endpoint.endswith("/reactions/{emoji}/{member_id}") or endpoint.endswith("/reactions/{emoji}/@me"):
+            user_id = BOT_ID if route.path.endswith("@me") else int(args["member_id"])
+            emoji_name = unquote(args["emoji"]).split(":")[0]
+            if emoji_name in self.emojis:
+                self.react(channel_id, int(args["message_id"]), user_id, emoji_name, add=route.method == "PUT", echo=True)
+            return None
+        if endpoint.endswith(" /guilds/{guild_id}/members/{user_id}/roles/{role_id}"):
+            roles = [role_id for role_id in self.members[int(args["user_id"])]["roles"] if role_id != args["role_id"]]
+            if route.method == "PUT":
+                roles.append(args["role_id"])
+            self.set_roles(int(args["user_id"]), roles)
+            return None
+        if endpoint == "PATCH /guilds/{guild_id}/members/{user_id}":
+            member = self.members[int(args["user_id"])]
+            if payload and "roles" in payload:
+                member = self.set_roles(int(args["user_id"]), [int(role_id) for role_id in payload["roles"]])
+            return member
+        if endpoint in ("GET /channels/{channel_id}", "PATCH /channels/{channel_id}"):
+            channel = self.channels[channel_id]
+            channel.update(payload or {})
+            return channel
+        return {}
+
+    def bot_message(self, channel_id, payload):
+        embeds = payload.get("embeds") or ([payload["embed"]] if payload.get("embed") else [])
+        if channel_id in self.dm_channels:
+            message_id = self.next_id()
+            return {
+                "id": str(message_id), "channel_id": str(channel_id), "author": self.bot,
+                "content": payload.get("content") or "", "timestamp": self.now(), "edited_timestamp": None, "tts": False,
+                "mention_everyone": False, "mentions": [], "mention_roles": [], "attachments": [],
+                "embeds": embeds, "pinned": False, "type": 0,
+            }
+        return self.messages[self.message(channel_id, BOT_ID, payload.get("content") or "", embeds, echo=True)]
+
+    def fetch_history(self, channel_id, query):
+        #Newest first, like the real endpoint
+        message_ids = self.history[channel_id]
+        if query.get("before"):
+            message_ids = [message_id for message_id in message_ids if message_id < int(query["before"])]
+        if query.get("after"):
+            message_ids = [message_id for message_id in message_ids if message_id > int(query["after"])]
+        limit = int(query.get("limit", 50))
+        return [self.messages[message_id] for message_id in reversed(message_ids[-limit:])]
+
+    def report(self):
+        events = sum(self.events.values())
+        elapsed = self.finished - self.started
+        calls = sum(self.http.calls.values())
+        latency = defaultdict(dict)
+        for (kind, name), samples in sorted(self.samples.items()):
+            latency[kind][name] = percentiles(samples)
+        return {
+            "events": dict(self.events),
+            "echoed_events": dict(self.echoed),
+            "wall_seconds": round(elapsed, 4),
+            "events_per_second": round(events / elapsed, 1) if elapsed else None,
+            "latency_ms": latency,
+            "errors": {f"{kind} {name}": histogram.errors for (kind, name), histogram in self.client.metrics.timings.items() if histogram.errors},
+            "api_calls": dict(self.http.calls),
+            "api_calls_per_event": round(calls / events, 3) if events else None,
+            "rate_limited": dict(self.http.rate_limited),
+            "rate_limit_wait_seconds": round(self.http.waited, 3),
+        }
+
+
+def route_args(route):
+    """Pull the parameters back out of a Route's URL using its path template."""
+    pattern = re.sub(r"\\\{(\w+)\\\}", r"(?P<\1>[^/]+)", re.escape(route.path))
+    match = re.fullmatch(pattern, route.url[len(Route.BASE):])
+    return match.groupdict() if match else {}
@@ -1,7 +1,18 @@
+import time
+STARTED = time.perf_counter()
+
 import discord
 import os
 import asyncio
 from discord.ext import commands
+from utils.channel_status import ChannelStatusWriter
+from utils.dispatch import MessageRouter
+from utils.extensions import load_timed
+from utils.log_sink import LogSink
+from utils.message_cache import MessageCache
+from utils.metrics import Metrics
+from utils.ratelimit import RateLimitWatcher
+from utils.storage import Storage
 
 intents = discord.Intents.default()
 intents.members = True
@@ -13,18 +24,108 @@ intents.reactions = True
 
 client = commands.Bot(command_prefix=".", owner_id=83616065854115840, description="DevBot", intents=intents)
 client.remove_command('help')
+#Latency, error and API call counters, shown by .metrics, see utils/metrics.py
+client.metrics = Metrics()
+client.metrics.install(client)
+#Reads Discord's rate limit headers for the RateLimiters and metrics
+RateLimitWatcher.install(client)
+#Shared message preprocessing and keyword triggers for the responder cogs, see utils/dispatch.py
+client.router = MessageRouter(client, client.command_prefix)
+client.add_listener(client.router.on_message)
+client.add_listener(client.router.on_message_edit)
+#Set once the channels below have been resolved, cogs that use them wait on it
+client.channelsReady = asyncio.Event()
+#Batches everything bound for the bot log channel, see utils/log_sink.py
+client.logSink = LogSink(client, lambda: getattr(client, "botLogChannel", None), ready=client.channelsReady)
+#Compact copy of recent messages so edits/deletes the library cache has dropped still get logged
+client.messageCache = MessageCache(int(os.environ.get("MESSAGE_CACHE_SIZE", 10000)), int(os.environ.get("MESSAGE_CACHE_MAX_AGE", 7 * 24 * 3600)))
+#IDs of messages .clearchat is deleting and has already archived, Logs leaves them out
+client.purgedMessages = set()
+#Queues status channel renames within Discord's rename limit, see utils/channel_status.py
+client.channelStatus = ChannelStatusWriter(client)
+#All persistent state, see utils/storage.py. DATABASE_PATH has to be on persistent storage,
+#a dyno's own filesystem is wiped on every restart
+client.storage = Storage(os.environ.get("DATABASE_PATH", "data/devbot.db"), log=client.logSink.send)
+#Extension name -> (load status, seconds taken), source hash when loaded, and state handed over between reloads
+client.cogTimings = {}
+client.cogHashes = {}
+client.cogState = {}
 
 TOKEN = os.environ["TOKEN"]
 
+CHANNELS = {
+    "botLogChannel": 814152479100633128,
+    "botCommandChannel": 517651663729852416,
+    "roomChannel": 892436503890915438,
+}
+#Seconds between attempts at resolving channels that failed at startup
+CHANNEL_RETRY = 60
+
+startup_task = None
+
 @client.event
 async def on_ready():
+    global startup_task
 
     print(f"\n\nLogged in as: {client.user.name} - {client.user.id}\nVersion: {discord.__version__}\n")
     print("Successfully logged in")
 
-    client.botLogChannel = await client.fetch_channel(814152479100633128)
-    client.botCommandChannel = await client.fetch_channel(517651663729852416)
-    client.roomChannel = await client.fetch_channel(892436503890915438)
+    #on_ready fires again after reconnects, the channels only need resolving once (unless that failed)
+    if startup_task is None or (startup_task.done() and not client.channelsReady.is_set()):
+        startup_task = asyncio.ensure_future(startup())
+
+async def resolve_channel(name, channel_id):
+    start = time.perf_counter()
+    channel = client.get_channel(channel_id)
+    source = "cache"
+    if channel is None:
+        channel = await client.fetch_channel(channel_id)
+        source = "REST"
+    setattr(client, name, channel)
+    return name, source, time.perf_counter() - start
+
+async def resolve_channels(channels):
+    #Returns the ones that resolved, and name -> (channel ID, error) for the rest
+    results = await asyncio.gather(*(resolve_channel(name, channel_id) for name, channel_id in channels.items()), return_exceptions=True)
+    resolved = []
+    failed = {}
+    for (name, channel_id), result in zip(channels.items(), results):
+        if isinstance(result, Exception):
+            print(f"Could not resolve channel {name} ({channel_id}): {result!r}")
+            failed[name] = (channel_id, result)
+        else:
+            resolved.append(result)
+    return resolved, failed
+
+def retryable(failed):
+    #A channel that is gone or hidden from the bot won't come back by retrying
+    return {name: channel_id for name, (channel_id, error) in failed.items() if not isinstance(error, (discord.NotFound, discord.Forbidden))}
+
+async def retry_channels(failed):
+    retry = retryable(failed)
+    while retry:
+        await asyncio.sleep(CHANNEL_RETRY)
+        resolved, failed = await resolve_channels(retry)
+        for name, source, elapsed in resolved:
+            client.logSink.send(f"Resolved channel {name} after retrying")
+        retry = retryable(failed)
+
+async def startup():
+    resolved, failed = await resolve_channels(CHANNELS)
+    #Set even if some failed so the log sink and the cogs waiting on it carry on, the failed ones are retried
+    client.channelsReady.set()
+    if failed:
+        client.loop.create_task(retry_channels(failed))
+    ready_in = time.perf_counter() - STARTED
+    print(f"Ready in {ready_in:.2f}s")
+
+    embed=discord.Embed(title="Startup Report", description=f"Ready {ready_in:.2f}s after launch", color=0xe7ec11)
+    lines = [f"{name}: {source} ({elapsed * 1000:.0f}ms)" for name, source, elapsed in resolved]
+    lines += [f"{name}: failed ({type(error).__name__})" for name, (channel_id, error) in failed.items()]
+    embed.add_field(name="Channels", value="\n".join(lines), inline=False)
+    cogs = sorted(client.cogTimings.items(), key=lambda item: item[1][1], reverse=True)
+    embed.add_field(name="Cogs", value="\n".join(f"{name[5:]}: {elapsed * 1000:.0f}ms" + ("" if status == "Successful" else f" - {status}") for name, (status, elapsed) in cogs) or "None", inline=False)
+    client.logSink.send(embed=embed)
 
 #function to make the bot print every 28mins so Heroku doesn't stop it
 async def stay_awake():
@@ -33,10 +134,15 @@ async def stay_awake():
         print('Im awake :)')
         await asyncio.sleep(1680) #runs every 28mins.
 
-for filename in os.listdir("./cogs"):
+for filename in sorted(os.listdir("./cogs")):
     if filename.endswith(".py"):
-        client.load_extension(f"cogs.{filename[:-3]}")
-        print(f"Loaded Cog: {filename}")
+        status, elapsed = load_timed(client, f"cogs.{filename[:-3]}")
+        print(f"Loaded Cog: {filename} ({status}, {elapsed * 1000:.0f}ms)")
 
 client.loop.create_task(stay_awake())
+client.logSink.start()
+#Prometheus text endpoint on localhost, off unless a port is given
+if os.environ.get("METRICS_PORT"):
+    client.loop.create_task(client.metrics.serve(int(os.environ["METRICS_PORT"])))
 client.run(TOKEN)
+client.storage.close()
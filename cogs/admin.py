@@ -1,6 +1,59 @@
 import discord
+import asyncio
 import datetime
+import csv
+import io
+import json
+import re
+from collections import Counter
 from discord.ext import commands
+from utils.extensions import take_state
+from utils.ratelimit import RateLimiter
+
+ANNOUNCEMENT_ROLE = 668158580716732456
+#.clearchat deletes at most MAX_CLEAR messages, looking through at most MAX_SCAN for ones matching its filters
+MAX_CLEAR = 1000
+MAX_SCAN = 2000
+#Discord only bulk deletes messages younger than two weeks
+BULK_DELETE_AGE = datetime.timedelta(days=14)
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+def parse_filters(text):
+    """Split .clearchat filters into user IDs, a time window and the text messages must contain."""
+    users = set()
+    window = None
+    words = []
+    for word in text.split():
+        user = re.fullmatch(r"<@!?(\d+)>|(\d{15,20})", word)
+        duration = re.fullmatch(r"(\d+)([smhd])", word.lower())
+        if user:
+            users.add(int(user.group(1) or user.group(2)))
+        elif duration and window is None:
+            window = datetime.timedelta(seconds=int(duration.group(1)) * DURATION_UNITS[duration.group(2)])
+        else:
+            words.append(word)
+    return users, window, " ".join(words)
+
+def archive(messages):
+    """Write the messages, oldest first, as a text transcript and as JSON in one pass."""
+    text = io.StringIO()
+    data = io.StringIO()
+    data.write("[")
+    for number, message in enumerate(messages):
+        created = message.created_at.strftime('%Y-%m-%d %H:%M:%S')
+        attachments = [attachment.url for attachment in message.attachments]
+        embeds = [embed.title or embed.description or "Embedded Message" for embed in message.embeds]
+        text.write(f"[{created}] {message.author} ({message.author.id}): {message.content}")
+        for item in embeds:
+            text.write(f" [Embed: {item}]")
+        for url in attachments:
+            text.write(f" {url}")
+        text.write("\n")
+        record = {"id": message.id, "author": str(message.author), "author_id": message.author.id, "created_at": created,
+                  "content": message.content, "embeds": embeds, "attachments": attachments}
+        data.write(("," if number else "") + "\n    " + json.dumps(record))
+    data.write("\n]\n")
+    return text.getvalue(), data.getvalue()
 
 async def is_admin(ctx):
     committee = discord.utils.get(ctx.guild.roles, name='Committee')
@@ -12,78 +65,207 @@ class Admin(commands.Cog, command_attrs=dict(hidden=True)):
 
     def __init__(self, client):
         self.client = client
+        #Guild ID -> IDs of members with no role, or only the announcement role
+        self.unassigned = take_state(client, "Admin")
+        if self.unassigned is None:
+            self.unassigned = {}
+            self.client.loop.create_task(self.build_unassigned())
+
+    def export_state(self):
+        return self.unassigned
+
+    async def build_unassigned(self):
+        await self.client.wait_until_ready()
+        for guild in self.client.guilds:
+            self.unassigned[guild.id] = {member.id for member in guild.members if self.is_unassigned(member)}
+
+    def is_unassigned(self, member):
+        memberRoleCount = len(member.roles)
+        return memberRoleCount == 1 or (memberRoleCount == 2 and member.roles[1].id == ANNOUNCEMENT_ROLE)
+
+    def track_unassigned(self, member):
+        unassigned = self.unassigned.get(member.guild.id)
+        if unassigned is None:
+            return
+        if self.is_unassigned(member):
+            unassigned.add(member.id)
+        else:
+            unassigned.discard(member.id)
 
     @commands.command(aliases=['admincommands'])
     @commands.check(is_admin)
     async def adminhelp(self, ctx):
         embed=discord.Embed(title="Admin Commands", description="*This dialog gives you all the admin commands for DevBot.*", color=0xe7ec11)
-        embed.add_field(name=".clearchat (AMOUNT)", value="Clears a set number of messages from the chat.", inline=False)
-        embed.add_field(name=".servermute @user", value="Server mutes or unmutes a user.", inline=False)
+        embed.add_field(name=".clearchat (AMOUNT) (@user) (30m) (text)", value=f"Clears up to {MAX_CLEAR} messages from the chat, optionally only those by a user, from the last 30m/2h/1d or containing some text.", inline=False)
+        embed.add_field(name=".servermute @user (@user...)", value="Server mutes or unmutes a user, restoring their roles on unmute. With several users it only mutes.", inline=False)
         embed.add_field(name=".room (STATUS)", value="Sets the room status.", inline=False)
-        embed.add_field(name=".unassignedmembers", value="Provides a file of members with no role or just announcement role.", inline=False)
+        embed.add_field(name=".unassignedmembers (txt/csv/json)", value="Provides a file of members with no role or just announcement role.", inline=False)
         embed.set_footer(text="Feature developed by <J4Y>", icon_url="https://www.j4y.dev/botassets/j4y.gif")
         await ctx.send(embed=embed)
 
     #By Emi/Peter
     @commands.command()
     @commands.check(is_admin)
-    async def servermute(self, ctx, user: discord.Member = None):
-        if user:
-            servermute = discord.utils.get(ctx.guild.roles, name='Server Muted')
-            devsoc = discord.utils.get(ctx.guild.roles, name='DevSoc')
-            booster = discord.utils.get(ctx.guild.roles, name='Chosen One')
-            if servermute in user.roles:
-                await user.remove_roles(servermute)
-                await user.add_roles(devsoc)
-                await ctx.send("Removed server mute!")
-            else:
-                for role in user.roles[1:]:
-                    if role == booster:
-                        continue
-                    else:
-                        await user.remove_roles(role)
-                await user.add_roles(servermute)
-                await ctx.send("Server muted!")
-        else:
+    async def servermute(self, ctx, *users: discord.Member):
+        if not users:
             await ctx.send("Please tag a user!")
+            return
+
+        servermute = discord.utils.get(ctx.guild.roles, name='Server Muted')
+        if servermute is None:
+            await ctx.send("There is no 'Server Muted' role on this server!")
+            return
+        #Several users at once (e.g. a raid) are handled concurrently, paced to the member edit rate limit
+        limiter = RateLimiter(concurrency=4, rate=5.0, route="/members/")
+        if len(users) == 1:
+            result = await self.toggle_mute(users[0], servermute, limiter)
+            await ctx.send({"muted": "Server muted!", "unmuted": "Removed server mute!"}.get(result, "Couldn't change that user's roles!"))
+            return
+
+        #...and are only ever muted, so anyone already muted stays muted
+        results = await asyncio.gather(*(self.toggle_mute(user, servermute, limiter, unmute=False) for user in users))
+        await ctx.send(f"Server muted {results.count('muted')}, already muted {results.count('skipped')}, failed {results.count('failed')}")
+
+    def kept_roles(self, member):
+        #The booster role and integration managed roles can't be taken away
+        booster = discord.utils.get(member.guild.roles, name='Chosen One')
+        return [role for role in member.roles[1:] if role == booster or role.managed]
+
+    async def toggle_mute(self, user, servermute, limiter, unmute=True):
+        if servermute in user.roles and not unmute:
+            return "skipped"
+        storage = self.client.storage
+        kept = self.kept_roles(user)
+        try:
+            async with limiter:
+                if servermute in user.roles:
+                    snapshot = await storage.load_mute_snapshot(user.guild.id, user.id)
+                    if snapshot is None:
+                        #Muted before snapshots were kept, fall back to the DevSoc role
+                        devsoc = discord.utils.get(user.guild.roles, name='DevSoc')
+                        snapshot = [devsoc.id] if devsoc is not None else []
+                    restored = [user.guild.get_role(role_id) for role_id in snapshot]
+                    roles = kept + [role for role in restored if role is not None and role not in kept]
+                    await user.edit(roles=roles, reason="Server mute removed")
+                    storage.delete_mute_snapshot(user.guild.id, user.id)
+                    return "unmuted"
+                previous = [role.id for role in user.roles[1:] if role not in kept]
+                await user.edit(roles=kept + [servermute], reason="Server muted")
+                #Only once the edit went through, a failed mute mustn't leave a snapshot behind
+                storage.save_mute_snapshot(user.guild.id, user.id, previous)
+                return "muted"
+        except discord.HTTPException:
+            return "failed"
 
     @commands.command(aliases=['cleanchat'])
     @commands.check(is_admin)
-    async def clearchat(self, ctx, amount: int = 0):
+    async def clearchat(self, ctx, amount: int = 0, *, filters = ""):
         if amount <= 0:
-            await ctx.send("Please enter a number between 1-24")
-        elif amount > 24:
-            await ctx.send("You can only clear up to 24 messages at a time")
-        else:
-            messages = await ctx.channel.purge(limit=amount+1)
-            embed=discord.Embed(title="Chat Cleared", description=f"{amount} messages cleared from {ctx.channel.name} \n {str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}", color=0xe7ec11)
-            for message in messages:
-                if message.embeds:
-                    embed.add_field(name=message.author.name, value="Embedded Message", inline=False)
-                else:
-                    embed.add_field(name=message.author.name, value=message.content, inline=False)
-            embed.set_footer(text="Feature developed by <J4Y>", icon_url="https://www.j4y.dev/botassets/j4y.gif")
-            await self.client.botLogChannel.send(embed=embed)
+            await ctx.send(f"Please enter a number between 1-{MAX_CLEAR}")
+            return
+        if amount > MAX_CLEAR:
+            await ctx.send(f"You can only clear up to {MAX_CLEAR} messages at a time")
+            return
+        users, window, contains = parse_filters(filters)
+
+        #History comes newest first, so stop at the first message older than the window
+        cutoff = datetime.datetime.utcnow() - min(window or BULK_DELETE_AGE, BULK_DELETE_AGE)
+        messages = []
+        async for message in ctx.channel.history(limit=MAX_SCAN, before=ctx.message):
+            if len(messages) == amount or message.created_at < cutoff:
+                break
+            if users and message.author.id not in users:
+                continue
+            if contains and contains.lower() not in message.content.lower():
+                continue
+            messages.append(message)
+        if not messages:
+            await ctx.send("No messages matched those filters")
+            return
+
+        #Logs skips these, the archive below replaces its bulk delete log
+        targets = [ctx.message] + messages
+        purged = self.client.purgedMessages
+        purged.update(message.id for message in targets)
+        #Bulk deletes take 100 messages per call
+        deleted = 0
+        try:
+            for start in range(0, len(targets), 100):
+                await ctx.channel.delete_messages(targets[start:start + 100])
+                deleted = min(start + 100, len(targets))
+        except discord.HTTPException as e:
+            await ctx.send(f"Stopped after {len(targets[1:deleted])} messages: {e.text or e}")
+        finally:
+            #Any IDs whose delete event never arrives are forgotten after a minute
+            self.client.loop.call_later(60, purged.difference_update, [message.id for message in targets])
+        messages = targets[1:deleted]
+        if not messages:
+            return
+
+        messages.reverse()
+        text, data = archive(messages)
+        stamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        embed=discord.Embed(title="Chat Cleared", description=f"{len(messages)} messages cleared from {ctx.channel.mention} by {ctx.author.mention} \n {stamp}", color=0xe7ec11)
+        if filters:
+            embed.add_field(name="Filters", value=filters[:1024], inline=False)
+        authors = Counter(str(message.author) for message in messages)
+        embed.add_field(name="Authors", value="\n".join(f"{author}: {count}" for author, count in authors.most_common(5))[:1024], inline=False)
+        embed.set_footer(text="Feature developed by <J4Y>", icon_url="https://www.j4y.dev/botassets/j4y.gif")
+        name = f"clearchat-{ctx.channel.name}-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}"
+        files = [discord.File(io.BytesIO(text.encode()), f"{name}.txt"), discord.File(io.BytesIO(data.encode()), f"{name}.json")]
+        self.client.logSink.send(embed=embed, files=files)
 
     @commands.command(aliases=['unassigned'])
     @commands.check(is_admin)
-    async def unassignedmembers(self, ctx):
-        membersWithoutRoles = []
+    async def unassignedmembers(self, ctx, fileFormat = "txt"):
+        fileFormat = fileFormat.lower()
+        if fileFormat not in ("txt", "csv", "json"):
+            await ctx.send("Choose a format of txt, csv or json")
+            return
         guild = ctx.message.guild
-        announcementRole = guild.get_role(668158580716732456)
-        for member in guild.members:
-            memberRoleCount = 0
-            for role in member.roles:
-                memberRoleCount += 1
-            if (memberRoleCount == 2 and announcementRole in member.roles) or memberRoleCount == 1:
-                memberString = f'{member.name}#{member.discriminator}' if member.nick == None else f'{member.nick} ({member.name}#{member.discriminator})'
-                membersWithoutRoles.append(memberString)
-        with open("result.txt", "w") as file:
-            for member in membersWithoutRoles:
-                file.write(member+"\n")
-        with open("result.txt", "rb") as file:
-            await ctx.send("There are {0} members without a role on the server. Here are the members without roles:".format(len(membersWithoutRoles)), file=discord.File(file, "result.txt"))
-        file.close()
+        if guild.id not in self.unassigned:
+            await self.build_unassigned()
+        members = [guild.get_member(member_id) for member_id in self.unassigned[guild.id]]
+        members = sorted((member for member in members if member is not None), key=lambda member: member.joined_at or datetime.datetime.min)
+
+        rows = []
+        for member in members:
+            memberString = f'{member.name}#{member.discriminator}' if member.nick == None else f'{member.nick} ({member.name}#{member.discriminator})'
+            joined = member.joined_at.strftime("%Y-%m-%d %H:%M:%S") if member.joined_at else ""
+            rows.append((memberString, str(member.id), joined))
+
+        buffer = io.StringIO()
+        if fileFormat == "csv":
+            writer = csv.writer(buffer)
+            writer.writerow(("member", "id", "joined"))
+            writer.writerows(rows)
+        elif fileFormat == "json":
+            json.dump([{"member": member, "id": member_id, "joined": joined} for member, member_id, joined in rows], buffer, indent=4)
+        else:
+            for member, member_id, joined in rows:
+                buffer.write(f"{member} - {member_id} - joined {joined}\n")
+        file = discord.File(io.BytesIO(buffer.getvalue().encode()), f"unassigned.{fileFormat}")
+        await ctx.send("There are {0} members without a role on the server. Here are the members without roles:".format(len(rows)), file=file)
+
+    #Members that changed while the gateway was disconnected never sent events, so rebuild on every (re)connect
+    @commands.Cog.listener()
+    async def on_ready(self):
+        await self.build_unassigned()
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member):
+        self.track_unassigned(member)
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before, after):
+        if before.roles != after.roles:
+            self.track_unassigned(after)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member):
+        unassigned = self.unassigned.get(member.guild.id)
+        if unassigned is not None:
+            unassigned.discard(member.id)
 
 
             
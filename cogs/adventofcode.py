@@ -1,102 +1,138 @@
 import discord
 from discord.ext import commands
-import json
+import asyncio
 import datetime
-import requests
+import aiohttp
+from utils.extensions import take_state
 
 async def command_channels(ctx):
     return ctx.channel.id in (517651663729852416, 505476463492071425, 783009748001620039)
+
+LEADERBOARD_URL = "https://adventofcode.com/2021/leaderboard/private/view/984355.json"
+SESSION_VALUE = "53616c7465645f5feafb8776e83c6df5eefa9d89a8b82fb597f5a430cf47b76f03119daa005972eb810dab8a211fb8ef"
+#Advent of Code asks for private leaderboards to be polled no more than every 15 minutes
+REFRESH_INTERVAL = 15 * 60
+#Outside December the leaderboard barely changes
+OFF_SEASON_INTERVAL = 24 * 3600
+
+def refresh_interval():
+    return REFRESH_INTERVAL if datetime.datetime.now().month == 12 else OFF_SEASON_INTERVAL
+
+class LeaderboardCache:
+
+    def __init__(self, client, state = None):
+        self.client = client
+        self.session = None
+        self.updated = None
+        self.scores = ""
+        #Day -> rendered "name: stars" lines for that day
+        self.stars = {}
+        self.ready = asyncio.Event()
+        delay = 0
+        if state:
+            #Carry on from a reload without polling AoC early
+            self.updated, self.scores, self.stars = state["updated"], state["scores"], state["stars"]
+            self.ready.set()
+            delay = max(0, refresh_interval() - (datetime.datetime.now() - self.updated).total_seconds())
+        self.task = client.loop.create_task(self.refresh_loop(delay))
+
+    def export_state(self):
+        if self.updated is None:
+            return None
+        return {"updated": self.updated, "scores": self.scores, "stars": self.stars}
+
+    def stop(self):
+        self.task.cancel()
+        if self.session is not None:
+            self.client.loop.create_task(self.session.close())
+
+    async def refresh_loop(self, delay = 0):
+        await asyncio.sleep(delay)
+        while True:
+            try:
+                await self.refresh()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                #Keep serving the last good leaderboard
+                print(f"Advent of Code refresh failed: {e!r}")
+            except Exception as e:
+                #Anything else (e.g. AoC changing the payload) won't fix itself, so say so in the bot log too
+                print(f"Advent of Code refresh failed: {e!r}")
+                self.client.logSink.send(f"Advent of Code leaderboard refresh failed, serving the last good one: {e!r}")
+            await asyncio.sleep(refresh_interval())
+
+    async def refresh(self):
+        if self.session is None:
+            self.session = aiohttp.ClientSession(cookies={'session': SESSION_VALUE}, timeout=aiohttp.ClientTimeout(total=10))
+        async with self.session.get(LEADERBOARD_URL) as response:
+            response.raise_for_status()
+            data = await response.json(content_type=None)
+        self.build(data)
+
+    def build(self, data):
+        members = []
+        for member_id, member in data["members"].items():
+            name = member["name"] or f"(anonymous user #{member_id})"
+            members.append((name, int(member["local_score"]), member.get("completion_day_level", {})))
+
+        ranking = sorted(((name, score) for name, score, _ in members), key=lambda tup: tup[1], reverse=True)
+        self.scores = "".join(f"**{name}**: {score}\n" for name, score in ranking if score >= 1)[:1024]
+
+        stars = {}
+        for name, _, days in members:
+            for day, levels in days.items():
+                stars.setdefault(day, []).append((name, len(levels)))
+        self.stars = {}
+        for day, counts in stars.items():
+            counts.sort(key=lambda tup: tup[1], reverse=True)
+            self.stars[day] = "".join(f"**{name}**: {count}\n" for name, count in counts)[:1024]
+
+        self.updated = datetime.datetime.now()
+        self.ready.set()
+
+    async def wait_ready(self, timeout=10):
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def footer(self):
+        if refresh_interval() == REFRESH_INTERVAL:
+            return f"Updated at {self.updated.strftime('%H:%M')}, data may be 15 minutes old"
+        return f"Updated on {self.updated.strftime('%d %b at %H:%M')}, refreshed daily outside December"
     
 class Adventofcode(commands.Cog):
 
     def __init__(self, client):
         self.client = client
+        self.leaderboard = LeaderboardCache(client, take_state(client, "Adventofcode"))
+
+    def export_state(self):
+        return self.leaderboard.export_state()
+
+    def cog_unload(self):
+        self.leaderboard.stop()
     
     #Advent of Code Leaderboard
     @commands.command()
     async def adventofcode(self, ctx):
-        global adventCodeTimer
-        timePassed = 0
-        if adventCodeTimer == 0:
-            adventCodeTimer = datetime.datetime.now()
-            timePassed = 15
-        else:
-            difference = datetime.datetime.now() - adventCodeTimer
-            timePassed = divmod(difference.days * 86400 + difference.seconds, 60)
-            timePassed = timePassed[0]
-        global adventCache
-        if timePassed < 15 and len(adventCache) > 0:
-            pass
-        else:
-            adventCodeTimer = datetime.datetime.now()
-            sessionValue = "53616c7465645f5feafb8776e83c6df5eefa9d89a8b82fb597f5a430cf47b76f03119daa005972eb810dab8a211fb8ef"
-            cookies = {'session': sessionValue}
-            response =  requests.get("https://adventofcode.com/2021/leaderboard/private/view/984355.json", cookies=cookies, timeout=10)
-            assert response.status_code == 200, f"Failed request: {response.text}"
-            data = response.content
-            adventCache = json.loads(data)
-        dataArray = []
-        for member in adventCache["members"]:
-            userTuple = (adventCache["members"][member]["name"], int(adventCache["members"][member]["local_score"]))
-            dataArray.append(userTuple)
-        dataArray.sort(key=lambda tup: tup[1], reverse=True)
+        if not await self.leaderboard.wait_ready():
+            await ctx.send("The Advent of Code leaderboard isn't available yet, try again later.")
+            return
         advent=discord.Embed(title="__Advent of Code - Leaderboard__", color=0xe7ec11)
-        theScores = ""
-        for x in dataArray:
-            if int(x[1]) < 1:
-                continue
-            username = x[0]
-            score = x[1]
-            theScores = theScores + "**"+str(username)+"**: "+str(score)+"\n"
-        advent.add_field(name="Scores", value=theScores, inline=False)
-        advent.set_footer(text="Data may be 15 minutes old")
+        advent.add_field(name="Scores", value=self.leaderboard.scores or "No scores yet", inline=False)
+        advent.set_footer(text=self.leaderboard.footer())
         await ctx.send(embed=advent)
 
     @commands.command()
     async def adventstars(self, ctx, day):
-        global adventCodeTimer
-        global adventCache
-        timePassed = 0
-        if adventCodeTimer == 0:
-            adventCodeTimer = datetime.datetime.now()
-            timePassed = 15
-        else:
-            difference = datetime.datetime.now() - adventCodeTimer
-            timePassed = divmod(difference.days * 86400 + difference.seconds, 60)
-            timePassed = timePassed[0]
-        if timePassed < 15 and len(adventCache) > 0:
-            pass
-        else:
-            adventCodeTimer = datetime.datetime.now()
-            sessionValue = "53616c7465645f5feafb8776e83c6df5eefa9d89a8b82fb597f5a430cf47b76f03119daa005972eb810dab8a211fb8ef"
-            cookies = {'session': sessionValue}
-            response = requests.get("https://adventofcode.com/2021/leaderboard/private/view/984355.json", cookies=cookies, timeout=10)
-            assert response.status_code == 200, f"Failed request: {response.text}"
-            data = response.content
-            adventCache = json.loads(data)
-        dataArray = []
-        for member in adventCache["members"]:
-            counter = 0
-            for x in adventCache["members"][member]["name"]["completion_day_level"][day]:
-                counter += 1
-            userTuple = (adventCache["members"][member]["name"], counter)
-            dataArray.append(userTuple)
-        dataArray.sort(key=lambda tup: tup[1], reverse=True)
+        if not await self.leaderboard.wait_ready():
+            await ctx.send("The Advent of Code leaderboard isn't available yet, try again later.")
+            return
         advent=discord.Embed(title="__Advent of Code - Day "+day+" Stars__", color=0xe7ec11)
-        theStars = ""
-        for x in dataArray:
-            username = x[0]
-            stars = x[1]
-            theStars = theStars + "**"+str(username)+"**: "+str(stars)+"\n"
-        advent.add_field(name="Stars", value=theStars, inline=False)
-        advent.set_footer(text="Data may be 15 minutes old")
+        advent.add_field(name="Stars", value=self.leaderboard.stars.get(day) or "Nobody has stars for this day yet", inline=False)
+        advent.set_footer(text=self.leaderboard.footer())
         await ctx.send(embed=advent)
 
 def setup(client):
     client.add_cog(Adventofcode(client))
-
-
-#Timer variable for advent of code command
-adventCodeTimer = 0
-#Advent code cached data
-adventCache = []
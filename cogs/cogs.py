@@ -1,6 +1,7 @@
 import discord
 import os
 from discord.ext import commands
+from utils.extensions import load_timed, reload_timed
 
 class Cogs(commands.Cog, command_attrs=dict(hidden=True)):
 
@@ -8,12 +9,8 @@ class Cogs(commands.Cog, command_attrs=dict(hidden=True)):
         self.client = client
 
     def __loadCog__(self, ctx, cog):
-        try:
-            self.client.load_extension(f"cogs.{cog}")
-        except Exception as e:
-            return cog, type(e).__name__
-        else:
-            return cog, "Successful"
+        status, elapsed = load_timed(self.client, f"cogs.{cog}")
+        return cog, f"{status} ({elapsed * 1000:.0f}ms)"
 
     def __unloadCog__(self, ctx, cog):
         try:
@@ -23,6 +20,12 @@ class Cogs(commands.Cog, command_attrs=dict(hidden=True)):
         else:
             return cog, "Successful"
 
+    def __reloadCog__(self, ctx, cog, force):
+        status, elapsed = reload_timed(self.client, f"cogs.{cog}", force)
+        if status == "Unchanged":
+            return cog, status
+        return cog, f"{status} ({elapsed * 1000:.0f}ms)"
+
     @commands.command()
     @commands.is_owner()
     async def load(self, ctx, extension):
@@ -65,24 +68,30 @@ class Cogs(commands.Cog, command_attrs=dict(hidden=True)):
         embed.set_footer(text="Feature developed by <J4Y>", icon_url="https://www.j4y.dev/botassets/j4y.gif")
         await ctx.send(embed=embed) 
 
+    #".reload all" only reloads cogs whose source (or utils module they use) changed, add "force" to reload them all
+    #utils modules bot.py uses (see SHARED in utils/extensions.py) need a restart
     @commands.command()
     @commands.is_owner()
-    async def reload(self, ctx, extension):
+    async def reload(self, ctx, extension, option = None):
         embed=discord.Embed(title="Cog Reload", color=0xe7ec11)
 
         if extension == "all":
-            for filename in os.listdir("./cogs"):
+            unchanged = []
+            for filename in sorted(os.listdir("./cogs")):
                 if filename.endswith(".py"):
-                    msgname, msgvalue = self.__unloadCog__(ctx, filename[:-3])
-                    msgname, msgvalue = self.__loadCog__(ctx, filename[:-3])
-                    embed.add_field(name=msgname, value=msgvalue, inline=False)
+                    msgname, msgvalue = self.__reloadCog__(ctx, filename[:-3], option == "force")
+                    if msgvalue == "Unchanged":
+                        unchanged.append(msgname)
+                    else:
+                        embed.add_field(name=msgname, value=msgvalue, inline=False)
+            if unchanged:
+                embed.add_field(name="Unchanged", value=", ".join(unchanged), inline=False)
         else:
-            msgname, msgvalue = self.__unloadCog__(ctx, extension)
-            msgname, msgvalue = self.__loadCog__(ctx, extension)
+            msgname, msgvalue = self.__reloadCog__(ctx, extension, True)
             embed.add_field(name=msgname, value=msgvalue, inline=False)
             
         embed.set_footer(text="Feature developed by <J4Y>", icon_url="https://www.j4y.dev/botassets/j4y.gif")
         await ctx.send(embed=embed) 
 
 def setup(client):
-    client.add_cog(Cogs(client))
\ No newline at end of file
+    client.add_cog(Cogs(client))
@@ -1,25 +1,48 @@
 import discord
 from discord.ext import commands
+import aiohttp
+import asyncio
 import json
-import requests
+import os
+from utils.extensions import take_state
+from utils.http_cache import CoalescingCache
 
 async def command_channels(ctx):
     return ctx.channel.id in (517651663729852416, 505476463492071425)
+
+#Overridable so the cog can be pointed at a local stub server
+ENDPOINT = os.environ.get("COVID_API_URL", "https://api.coronavirus.data.gov.uk/v1/data")
+#The dashboard only updates once a day
+CACHE_TTL = 30 * 60
+
+class CovidAPIError(Exception):
+    pass
     
 class Covid(commands.Cog):
 
     def __init__(self, client):
         self.client = client
-    
-    #By Emi/Peter
-    @commands.command()
-    @commands.check(command_channels)
-    async def covidoverview(self, ctx):
-        ENDPOINT = "https://api.coronavirus.data.gov.uk/v1/data"
-        AREA_TYPE = "overview"
+        state = take_state(client, "Covid") or {}
+        self.handed_off = False
+        self.session = state.get("session")
+        self.cache = state.get("cache") or CoalescingCache(self.fetch_cases, ttl=CACHE_TTL)
+        self.cache.fetch = self.fetch_cases
+
+    def export_state(self):
+        self.handed_off = True
+        return {"session": self.session, "cache": self.cache}
+
+    def cog_unload(self):
+        if self.session is not None and not self.handed_off:
+            self.client.loop.create_task(self.session.close())
+
+    async def fetch_cases(self, key):
+        area_type, area_name = key
         filters = [
-            f"areaType={ AREA_TYPE }",
+            f"areaType={ area_type }",
         ]
+        if area_name:
+            filters.append(f"areaName={ area_name }")
         structure = {
             "dailyCases": "newCasesByPublishDate",
             "cumulativeCases": "cumCasesByPublishDate"
@@ -28,52 +51,79 @@ class Covid(commands.Cog):
             "filters": str.join(";", filters),
             "structure": json.dumps(structure, separators=(",", ":")),
             "latestBy": "cumCasesByPublishDate",
+            "format": "json",
         }
-        api_params["format"] = "json"
-        response = requests.get(ENDPOINT, params=api_params, timeout=10)
-        assert response.status_code == 200, f"Failed request: {response.text}"
-        data = json.loads(response.content)
-        totalcases = int(data['data'][0]['cumulativeCases'])
-        dailycases = int(data['data'][0]['dailyCases'])
+        if self.session is None:
+            self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+        try:
+            async with self.session.get(ENDPOINT, params=api_params) as response:
+                #No content means the area doesn't exist, which is worth caching too
+                if response.status in (204, 404):
+                    return None
+                if response.status != 200:
+                    raise CovidAPIError(f"Failed request: {response.status}")
+                data = await response.json(content_type=None)
+            if not data.get('data'):
+                return None
+            return int(data['data'][0]['cumulativeCases']), int(data['data'][0]['dailyCases'])
+        except asyncio.TimeoutError as e:
+            raise CovidAPIError("Request timed out") from e
+        #Includes a payload that isn't shaped the way we expect
+        except (aiohttp.ClientError, ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+            raise CovidAPIError(str(e)) from e
+
+    async def get_cases(self, ctx, area_type, area_name = None):
+        try:
+            cases, fetched_at, stale = await self.cache.get((area_type, area_name))
+        except CovidAPIError:
+            await ctx.send("The COVID dashboard isn't responding right now, try again later.")
+            return None
+        note = None
+        if stale:
+            note = f"The COVID dashboard isn't responding, showing data from {fetched_at.strftime('%Y-%m-%d %H:%M')}"
+        return cases, note
+
+    #By Emi/Peter
+    @commands.command()
+    @commands.check(command_channels)
+    async def covidoverview(self, ctx):
+        result = await self.get_cases(ctx, "overview")
+        if result is None:
+            return
+        cases, note = result
+        if cases is None:
+            await ctx.send("The COVID dashboard has no data right now.")
+            return
+        totalcases, dailycases = cases
         embed=discord.Embed(title="__COVID Dashboard__", description="UK Government COVID Statistics", color=0xe7ec11)
         embed.add_field(name="Total Cases", value=totalcases, inline=False)
         embed.add_field(name="Daily Cases", value=dailycases, inline=False)
+        if note:
+            embed.set_footer(text=note)
         await ctx.send(embed=embed)
 
     #By Emi/Peter
     @commands.command()
     @commands.check(command_channels)
     async def covidregion(self, ctx, *region):
-        try:
-            region =  ' '.join(region)
-            ENDPOINT = "https://api.coronavirus.data.gov.uk/v1/data"
-            AREA_TYPE = "utla"
-            AREA_NAME = str(region.lower())
-            filters = [
-                f"areaType={ AREA_TYPE }",
-                f"areaName={ AREA_NAME }"
-            ]
-            structure = {
-                "dailyCases": "newCasesByPublishDate",
-                "cumulativeCases": "cumCasesByPublishDate"
-            }
-            api_params = {
-                "filters": str.join(";", filters),
-                "structure": json.dumps(structure, separators=(",", ":")),
-                "latestBy": "cumCasesByPublishDate",
-            }
-            api_params["format"] = "json"
-            response = requests.get(ENDPOINT, params=api_params, timeout=10)
-            assert response.status_code == 200, f"Failed request: {response.text}"
-            data = json.loads(response.content)
-            totalcases = int(data['data'][0]['cumulativeCases'])
-            dailycases = int(data['data'][0]['dailyCases'])
-            embed=discord.Embed(title="__COVID Dashboard - "+str(region)+"__", description=str(region)+" COVID Statistics", color=0xe7ec11)
-            embed.add_field(name="Region Cases", value=totalcases, inline=False)
-            embed.add_field(name="Region Daily Cases", value=dailycases, inline=False)
-            await ctx.send(embed=embed)
-        except:
+        region =  ' '.join(region)
+        if not region:
             await ctx.send("That's not a valid region!")
+            return
+        result = await self.get_cases(ctx, "utla", region.lower())
+        if result is None:
+            return
+        cases, note = result
+        if cases is None:
+            await ctx.send("That's not a valid region!")
+            return
+        totalcases, dailycases = cases
+        embed=discord.Embed(title="__COVID Dashboard - "+str(region)+"__", description=str(region)+" COVID Statistics", color=0xe7ec11)
+        embed.add_field(name="Region Cases", value=totalcases, inline=False)
+        embed.add_field(name="Region Daily Cases", value=dailycases, inline=False)
+        if note:
+            embed.set_footer(text=note)
+        await ctx.send(embed=embed)
 
 def setup(client):
-    client.add_cog(Covid(client))
\ No newline at end of file
+    client.add_cog(Covid(client))
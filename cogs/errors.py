@@ -1,17 +1,49 @@
 import discord
+import io
+import sys
+import time
+from datetime import datetime
 from discord.ext import commands
+from utils.error_reporter import ErrorReporter, describe
+from utils.extensions import take_state
+
+#Recent errors listed by .errors
+ERRORS_LISTED = 15
 
 class Error(commands.Cog):
 
     def __init__(self, client):
         self.client = client
+        self.handed_off = False
+        self.reporter = take_state(client, "Error") or ErrorReporter(client)
+        self.reporter.start()
+        #Event errors never reach a listener, so take over the client's handler
+        self.default_on_error = client.on_error
+        client.on_error = self.on_event_error
+        #Time of the first disconnect not yet reported, and how many happened since
+        self.disconnected_at = None
+        self.disconnects = 0
 
-    @commands.Cog.listener()
-    async def on_error(self, error):
+    def export_state(self):
+        self.handed_off = True
+        return self.reporter
+
+    def cog_unload(self):
+        self.client.on_error = self.default_on_error
+        if not self.handed_off:
+            self.reporter.stop()
+
+    async def on_event_error(self, event_method, *args, **kwargs):
+        error = sys.exc_info()[1]
+        #Still print the traceback to the console like the default handler
+        await self.default_on_error(event_method, *args, **kwargs)
+        if error is None:
+            return
 
         embed=discord.Embed(title="Error", description=f"{error}", color=0xe7ec11)
+        embed.add_field(name="Event:", value=event_method, inline=True)
         embed.set_footer(text="Feature developed by <J4Y>", icon_url="https://www.j4y.dev/botassets/j4y.gif")
-        await self.client.botLogChannel.send(embed=embed)
+        self.reporter.report(error, event_method, embed)
 
     @commands.Cog.listener()
     async def on_command_error(self, ctx, error):
@@ -19,15 +51,60 @@ class Error(commands.Cog):
         embed=discord.Embed(title="Error", url=f"{ctx.message.jump_url}", description=f"{error}", color=0xe7ec11)
         embed.set_author(name=f"{ctx.author.name}", icon_url=f"{ctx.author.avatar_url}")
         embed.add_field(name="Message:", value=f"{ctx.message.content}", inline=False)
-        embed.add_field(name="Server:", value=f"{ctx.guild.name}", inline=True)
-        embed.add_field(name="Channel:", value=f"{ctx.channel.name}", inline=True)  
+        embed.add_field(name="Server:", value=f"{ctx.guild.name if ctx.guild else 'DM'}", inline=True)
+        embed.add_field(name="Channel:", value=f"{getattr(ctx.channel, 'name', 'DM')}", inline=True)
         embed.set_footer(text="Feature developed by <J4Y>", icon_url="https://www.j4y.dev/botassets/j4y.gif")
-        await self.client.botLogChannel.send(embed=embed)
+        where = f".{ctx.command.qualified_name}" if ctx.command else "unknown command"
+        self.reporter.report(getattr(error, "original", error), where, embed)
 
     @commands.Cog.listener()
     async def on_disconnect(self):
         print("\n DISCONNECTED \n")
-        await self.client.botLogChannel.send("Sorry i disconnected")
+        #The connection is gone right now, say so once it is back
+        if self.disconnected_at is None:
+            self.disconnected_at = time.time()
+        self.disconnects += 1
+
+    @commands.Cog.listener()
+    async def on_resumed(self):
+        self.report_disconnect()
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        self.report_disconnect()
+
+    def report_disconnect(self):
+        if self.disconnected_at is None:
+            return
+        downtime = time.time() - self.disconnected_at
+        times = "once" if self.disconnects == 1 else f"{self.disconnects} times"
+        self.client.logSink.send(f"Sorry i disconnected ({times}, back after {downtime:.0f}s)")
+        self.disconnected_at = None
+        self.disconnects = 0
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def errors(self, ctx, number: int = None):
+        recent = list(reversed(self.reporter.recent))
+        if not recent:
+            await ctx.send("**No errors recorded**")
+            return
+
+        if number is None:
+            embed=discord.Embed(title="Recent Errors", description=f"{self.reporter.posted} posted, {self.reporter.suppressed} folded into summaries", color=0xe7ec11)
+            lines = [f"`{index}` {datetime.fromtimestamp(when).strftime('%H:%M:%S')} {describe(key)}" for index, (when, key, text) in enumerate(recent[:ERRORS_LISTED], 1)]
+            embed.add_field(name="Newest first", value="\n".join(lines)[:1024], inline=False)
+            embed.set_footer(text="Use .errors <number> for the traceback")
+            await ctx.send(embed=embed)
+        elif 1 <= number <= len(recent):
+            when, key, text = recent[number - 1]
+            header = f"{describe(key)} at {datetime.fromtimestamp(when).strftime('%Y-%m-%d %H:%M:%S')}"
+            if len(text) > 1800:
+                await ctx.send(header, file=discord.File(io.BytesIO(text.encode()), "traceback.txt"))
+            else:
+                await ctx.send(f"{header}\n```py\n{text}```")
+        else:
+            await ctx.send(f"Only the last {len(recent)} errors are kept")
 
 def setup(client):
-    client.add_cog(Error(client))
\ No newline at end of file
+    client.add_cog(Error(client))
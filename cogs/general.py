@@ -1,5 +1,7 @@
 import discord
+from collections import Counter
 from discord.ext import commands
+from utils.extensions import take_state
 
 async def command_channels(ctx):
     return ctx.channel.id in (517651663729852416, 505476463492071425)
@@ -8,6 +10,38 @@ class General(commands.Cog):
 
     def __init__(self, client):
         self.client = client
+        #Guild ID -> Counter of role ID -> number of members with that role
+        self.role_counts = take_state(client, "General")
+        if self.role_counts is None:
+            self.role_counts = {}
+            self.client.loop.create_task(self.build_role_counts())
+
+    def export_state(self):
+        return self.role_counts
+
+    async def build_role_counts(self):
+        await self.client.wait_until_ready()
+        for guild in self.client.guilds:
+            self.role_counts[guild.id] = self.count_roles(guild)
+
+    def count_roles(self, guild):
+        counts = Counter()
+        for member in guild.members:
+            counts.update(role.id for role in member.roles)
+        return counts
+
+    def get_role_counts(self, guild):
+        if guild.id not in self.role_counts:
+            self.role_counts[guild.id] = self.count_roles(guild)
+        return self.role_counts[guild.id]
+
+    def count_named_roles(self, guild, names):
+        counts = self.get_role_counts(guild)
+        named = {}
+        for name in names:
+            role = discord.utils.get(guild.roles, name=name)
+            named[name] = counts[role.id] if role else 0
+        return named
 
     #By Emi/Peter
     @commands.command()
@@ -60,7 +94,7 @@ class General(commands.Cog):
         thehelp.add_field(name=".github", value="Links to the github source code of the bot.", inline=False)
         thehelp.add_field(name=".members", value="Checks the members of each year group in the server.", inline=False)
         thehelp.add_field(name=".courses", value="Checks the members of each course in the server.", inline=False)
-        thehelp.add_field(name=".highlight", value=".highlight set [word] - To be notified whenever the word is said\n.highlight remove - Remove yourself from the highlights", inline=False)
+        thehelp.add_field(name=".highlight", value=".highlight set [word] - To be notified whenever the word is said\n.highlight remove [word] - Remove a word, or all of your highlights\n.highlight list - Show the words you are highlighted for", inline=False)
         thehelp.add_field(name=".covidoverview", value="Gives an overview of UK COVID cases.", inline=False)
         thehelp.add_field(name=".covidregion (REGION)", value="Gives an overview of COVID cases in a region of the UK.", inline=False)
         thehelp.set_footer(text="Feature developed by Emi/Peter")
@@ -69,20 +103,7 @@ class General(commands.Cog):
     @commands.command(aliases=['membercount', 'membercheck', 'memberlist'])
     @commands.check(command_channels)
     async def members(self, ctx):
-        devMembers = {
-            "First Year": 0,
-            "Second Year": 0,
-            "Placement Year": 0,
-            "Third Year": 0,
-            "Fourth Year": 0,
-            "MSc Student": 0,
-            "Alumni": 0
-        }
-        guild = ctx.message.guild
-        for member in guild.members:
-            for role in member.roles:
-                if role.name in devMembers:
-                    devMembers[role.name] += 1
+        devMembers = self.count_named_roles(ctx.guild, ("First Year", "Second Year", "Placement Year", "Third Year", "Fourth Year", "MSc Student", "Alumni"))
         count=discord.Embed(title="__DevSoc Members__", description="*Here are the members of each year group within this server.*", color=0xe7ec11)
         finalYearTotal = 0
         for year in devMembers:
@@ -99,28 +120,53 @@ class General(commands.Cog):
     @commands.command(aliases=['coursecount', 'coursecheck', 'courselist'])
     @commands.check(command_channels)
     async def courses(self, ctx):
-        devCourses = {
-            "Computer Science": 0,
-            "Software Engineering": 0,
-            "Computer Science (Games Technology)": 0,
-            "Computer Science (Artificial Intelligence)": 0,
-            "Computer Systems (Cyber Security)": 0,
-            "Computing": 0,
-            "Other": 0
-        }
-        guild = ctx.message.guild
-        for member in guild.members:
-            for role in member.roles:
-                if role.name in devCourses:
-                    devCourses[role.name] += 1
+        devCourses = self.count_named_roles(ctx.guild, ("Computer Science", "Software Engineering", "Computer Science (Games Technology)", "Computer Science (Artificial Intelligence)", "Computer Systems (Cyber Security)", "Computing", "Other"))
         count=discord.Embed(title="__DevSoc Members - Courses__", description="*Here are the members of each course within this server.*", color=0xe7ec11)
         for course in devCourses:
             count.add_field(name=course, value=str(devCourses[course])+" members", inline=False)
         count.set_footer(text="Feature developed by Peter")
         await ctx.send(embed=count)
 
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def rolecountcheck(self, ctx):
+        tracked = self.get_role_counts(ctx.guild)
+        actual = self.count_roles(ctx.guild)
+        drift = []
+        for role_id in set(tracked) | set(actual):
+            if tracked[role_id] != actual[role_id]:
+                role = ctx.guild.get_role(role_id)
+                drift.append(f"{role.name if role else role_id}: tracked {tracked[role_id]}, actual {actual[role_id]}")
+        self.role_counts[ctx.guild.id] = actual
+        if drift:
+            await ctx.send("Role counts had drifted and have been rebuilt:\n```\n" + "\n".join(drift)[:1900] + "\n```")
+        else:
+            await ctx.send("Role counts are consistent.")
+
+    #Members that changed while the gateway was disconnected never sent events, so recount on every (re)connect
+    @commands.Cog.listener()
+    async def on_ready(self):
+        await self.build_role_counts()
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before, after):
+        if before.roles == after.roles or before.guild.id not in self.role_counts:
+            return
+        before_ids = {role.id for role in before.roles}
+        after_ids = {role.id for role in after.roles}
+        counts = self.role_counts[after.guild.id]
+        counts.subtract(before_ids - after_ids)
+        counts.update(after_ids - before_ids)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member):
+        if member.guild.id in self.role_counts:
+            self.role_counts[member.guild.id].subtract(role.id for role in member.roles)
+
     @commands.Cog.listener()
     async def on_member_join(self, member):
+        if member.guild.id in self.role_counts:
+            self.role_counts[member.guild.id].update(role.id for role in member.roles)
         role = discord.utils.get(member.guild.roles, name='Announcement')
         try:
             await member.add_roles(role)
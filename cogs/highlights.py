@@ -1,90 +1,253 @@
 import discord
-import json
+import os
+from collections import OrderedDict, deque
 from discord.ext import commands
+from utils.dm_queue import DMQueue
+from utils.extensions import take_state
 
 async def command_channels(ctx):
     return ctx.channel.id in (517651663729852416, 505476463492071425)
 
+#Most words a single user can be highlighted for
+MAX_WORDS = 10
+#Messages of context shown above a highlighted message
+CONTEXT_LINES = 4
+#Recent messages kept per channel and how many channels are tracked at once
+CONTEXT_BUFFER_SIZE = int(os.environ.get("HIGHLIGHT_BUFFER_SIZE", 8))
+CONTEXT_BUFFER_CHANNELS = int(os.environ.get("HIGHLIGHT_BUFFER_CHANNELS", 100))
+
+class ContextRecord:
+    __slots__ = ("id", "author", "content", "embed")
+
+    def __init__(self, message):
+        self.id = message.id
+        self.author = message.author.name
+        self.content = message.content
+        self.embed = bool(message.embeds)
+
 class Highlights(commands.Cog):
 
     def __init__(self, client):
         self.client = client
-        with open("data/highlight_data.json") as file:
-            self.highlight_data = json.load(file)
+        #Left by the previous instance when the cog is reloaded, see export_state
+        state = take_state(client, "Highlights") or {}
+        self.handed_off = False
+        self.highlight_data = state.get("highlight_data", {})
+        self.highlight_index = {}
+        self.loaded = client.loop.create_task(self.load_highlights("highlight_data" in state))
+        #Channel ID -> deque of recent ContextRecords, least recently active channel first
+        self.context_buffer = state.get("context_buffer", OrderedDict())
+        self.context_hits = state.get("context_hits", 0)
+        self.context_misses = state.get("context_misses", 0)
+        self.dm_queue = state.get("dm_queue") or DMQueue(client, self.render_highlights)
+        self.dm_queue.render = self.render_highlights
+        self.dm_queue.start()
+        client.router.add_watcher(self, self.buffer_message, edits=True, bots=True, commands=True)
+        client.router.add_watcher(self, self.message_check, edits=True)
+
+    def export_state(self):
+        #The DM queue keeps running and is adopted by the reloaded cog
+        self.handed_off = True
+        return {
+            "highlight_data": self.highlight_data,
+            "context_buffer": self.context_buffer,
+            "context_hits": self.context_hits,
+            "context_misses": self.context_misses,
+            "dm_queue": self.dm_queue,
+        }
+
+    def cog_unload(self):
+        self.client.router.remove_owner(self)
+        if not self.handed_off:
+            self.dm_queue.stop()
+
+    async def load_highlights(self, handed_over = False):
+        if handed_over:
+            self.build_index()
+            return
+        self.highlight_data.update(await self.client.storage.load_highlights())
+        self.build_index()
+
+    def build_index(self):
+        #Word -> set of user IDs, so a message is matched with one lookup per token
+        self.highlight_index = {}
+        for user_id, words in self.highlight_data.items():
+            for word in words:
+                self.highlight_index.setdefault(word, set()).add(user_id)
+
+    def add_word(self, user_id, word):
+        words = self.highlight_data.setdefault(user_id, [])
+        if word in words:
+            return False
+        words.append(word)
+        self.highlight_index.setdefault(word, set()).add(user_id)
+        self.client.storage.add_highlight(user_id, word)
+        return True
+
+    def remove_word(self, user_id, word):
+        words = self.highlight_data.get(user_id, [])
+        if word not in words:
+            return False
+        words.remove(word)
+        if not words:
+            del self.highlight_data[user_id]
+        subscribers = self.highlight_index.get(word)
+        if subscribers is not None:
+            subscribers.discard(user_id)
+            if not subscribers:
+                del self.highlight_index[word]
+        self.client.storage.remove_highlight(user_id, word)
+        return True
+
+    def match(self, prepared):
+        #Collect every subscriber of every token in the message
+        matched = set()
+        for token in prepared.tokens:
+            subscribers = self.highlight_index.get(token)
+            if subscribers:
+                matched |= subscribers
+        matched.discard(str(prepared.message.author.id))
+        return matched
+
+    def buffer_message(self, prepared):
+        message = prepared.message
+        if prepared.edited:
+            self.buffer_edit(message)
+            return
+        records = self.context_buffer.get(message.channel.id)
+        if records is None:
+            records = self.context_buffer[message.channel.id] = deque(maxlen=CONTEXT_BUFFER_SIZE)
+            if len(self.context_buffer) > CONTEXT_BUFFER_CHANNELS:
+                self.context_buffer.popitem(last=False)
+        else:
+            self.context_buffer.move_to_end(message.channel.id)
+        records.append(ContextRecord(message))
+
+    def buffer_edit(self, message):
+        for record in self.context_buffer.get(message.channel.id, ()):
+            if record.id == message.id:
+                record.content = message.content
+                record.embed = bool(message.embeds)
+                return
 
-    def saveDB(self):
-        with open("data/highlight_data.json", "w") as file:
-            json.dump(self.highlight_data, file, sort_keys=True, indent=4)
+    def buffered_context(self, message):
+        #The earlier messages from the buffer, or None when it doesn't hold enough of them
+        records = [record for record in self.context_buffer.get(message.channel.id, ()) if record.id < message.id]
+        if len(records) < CONTEXT_LINES:
+            return None
+        self.context_hits += 1
+        return [(record.author, record.content, record.embed) for record in records[-CONTEXT_LINES:]]
 
-    async def message_check(self, message):
-        if message.author.bot:
-            return
+    async def fetch_context(self, message, matched):
+        self.context_misses += 1
+        history = await message.channel.history(limit=CONTEXT_LINES, before=message).flatten()
+        self.notify(message, matched, [(msg.author.name, msg.content, bool(msg.embeds)) for msg in reversed(history)])
 
-        if isinstance(message.channel, discord.channel.DMChannel):
-            return
+    def message_check(self, prepared):
+        #Bots, DMs and commands are already filtered out by the router
+        message = prepared.message
 
-        if message.content.startswith("."):
+        if message.channel.id in (505094359272652831, 813461899542790164, 505476463492071425, 814152479100633128, 886582676218331186):
             return
-        
-        if "hannah" in message.content.lower():
-            await message.channel.send("<@!131332703919276032> <:redacted:1101230074667204718> sus <:redacted:1101230074667204718>")
 
-        if message.channel.id in (505094359272652831, 813461899542790164, 505476463492071425, 814152479100633128, 886582676218331186):
+        if prepared.has_embeds:
             return
 
-        if message.embeds:
+        matched = self.match(prepared)
+        if not matched:
             return
 
-        for user_id, word in self.highlight_data.items():
-            if word in message.content.lower().split():
-                
-                if user_id == str(message.author.id):
-                    return
-
-                history = await message.channel.history(limit=4, before=message).flatten()
-                desc = ""
-                embed=discord.Embed(title="Highlight", url=f"{message.jump_url}", color=0xe7ec11)
-                for msg in reversed(history):
-                    if msg.embeds:
-                        desc += f"**{msg.author.name}**: [Embedded Message]\n"
-                    else:
-                        desc += f"**{msg.author.name}**: {msg.content}\n"
-                desc += f"__**{message.author.name}**: {message.content}__\n"
-                embed=discord.Embed(title="Highlight", url=f"{message.jump_url}",description=desc, color=0xe7ec11)
-                embed.set_footer(text="Feature developed by <J4Y>", icon_url="https://www.j4y.dev/botassets/j4y.gif")
-                user = message.guild.get_member(int(user_id))
-                await user.send(embed=embed)
-                return
+        #Read the buffer now, before later messages push this one's context out of it
+        context = self.buffered_context(message)
+        if context is None:
+            #Fetching from the API shouldn't hold up the router, router.call still logs and times it
+            self.client.loop.create_task(self.client.router.call(self.fetch_context, message, matched))
+        else:
+            self.notify(message, matched, context)
+
+    def notify(self, message, matched, context):
+        desc = ""
+        for author, content, embedded in context:
+            if embedded:
+                desc += f"**{author}**: [Embedded Message]\n"
+            else:
+                desc += f"**{author}**: {content}\n"
+        desc += f"__**{message.author.name}**: {message.content}__\n"
+
+        for user_id in matched:
+            user = message.guild.get_member(int(user_id))
+            if user is not None:
+                self.dm_queue.put(user, (desc, message.jump_url))
+
+    def render_highlights(self, excerpts, overflow):
+        if len(excerpts) == 1:
+            desc, url = excerpts[0]
+            embed=discord.Embed(title="Highlight", url=f"{url}", description=desc[:2048], color=0xe7ec11)
+        else:
+            desc = ""
+            for excerpt, url in excerpts:
+                entry = f"{excerpt}[Jump to message]({url})\n\n"
+                if len(desc) + len(entry) > 2048:
+                    overflow += 1
+                    continue
+                desc += entry
+            embed=discord.Embed(title=f"Highlights ({len(excerpts) + overflow})", description=desc, color=0xe7ec11)
+        if overflow:
+            embed.add_field(name="More", value=f"{overflow} more highlights were left out", inline=False)
+        embed.set_footer(text="Feature developed by <J4Y>", icon_url="https://www.j4y.dev/botassets/j4y.gif")
+        return embed
 
     @commands.command()
     @commands.check(command_channels)
     async def highlight(self, ctx, command, word = None):
 
+        await self.loaded
         embed=discord.Embed(title="Highlights", color=0xe7ec11)
+        user_id = str(ctx.author.id)
 
         if command.lower() == "set":
-            if word:
-                embed.add_field(name="Set", value=word, inline=False)
-                self.highlight_data[str(ctx.author.id)] = word.lower()
-            else:
+            if not word:
                 embed.add_field(name="Missing word", value="Provide a word to be notified for", inline=False)
+            elif len(self.highlight_data.get(user_id, [])) >= MAX_WORDS:
+                embed.add_field(name="Limit reached", value=f"You can only highlight up to {MAX_WORDS} words", inline=False)
+            else:
+                added = self.add_word(user_id, word.lower())
+                embed.add_field(name="Set" if added else "Already set", value=word.lower(), inline=False)
         elif command.lower() == "remove":
-            embed.add_field(name="Removed", value=self.highlight_data[str(ctx.author.id)], inline=False)
-            if str(ctx.author.id) in self.highlight_data:
-                del self.highlight_data[str(ctx.author.id)]
+            if word:
+                removed = [word.lower()] if self.remove_word(user_id, word.lower()) else []
+            else:
+                removed = list(self.highlight_data.get(user_id, []))
+                for highlighted in removed:
+                    self.remove_word(user_id, highlighted)
+            if removed:
+                embed.add_field(name="Removed", value=", ".join(removed), inline=False)
+            else:
+                embed.add_field(name="Nothing to remove", value="You aren't highlighted for that", inline=False)
+        elif command.lower() == "list":
+            words = self.highlight_data.get(user_id)
+            embed.add_field(name="Your words", value=", ".join(words) if words else "None", inline=False)
         else:
-            embed.add_field(name="Option Unknown", value="Try 'set' or 'remove'", inline=False)
+            embed.add_field(name="Option Unknown", value="Try 'set', 'remove' or 'list'", inline=False)
         embed.set_footer(text="Feature developed by <J4Y>", icon_url="https://www.j4y.dev/botassets/j4y.gif")
-        self.saveDB()
         await ctx.send(embed=embed)
 
-    @commands.Cog.listener()
-    async def on_message(self, message):
-        await self.message_check(message)
-
-    @commands.Cog.listener()
-    async def on_message_edit(self, before, after):
-        await self.message_check(after)
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def highlightstats(self, ctx):
+        lookups = self.context_hits + self.context_misses
+        hit_rate = f"{self.context_hits / lookups:.1%}" if lookups else "n/a"
+        embed=discord.Embed(title="Highlight Context Buffer", color=0xe7ec11)
+        embed.add_field(name="Buffer hits", value=self.context_hits, inline=True)
+        embed.add_field(name="API fetches", value=self.context_misses, inline=True)
+        embed.add_field(name="Hit rate", value=hit_rate, inline=True)
+        embed.add_field(name="Channels tracked", value=f"{len(self.context_buffer)}/{CONTEXT_BUFFER_CHANNELS}", inline=True)
+        embed.add_field(name="Messages buffered", value=sum(len(records) for records in self.context_buffer.values()), inline=True)
+        embed.add_field(name="DMs sent", value=self.dm_queue.sent, inline=True)
+        embed.add_field(name="DMs pending", value=len(self.dm_queue.pending), inline=True)
+        embed.add_field(name="Dropped/failed", value=f"{self.dm_queue.dropped}/{self.dm_queue.failed}", inline=True)
+        embed.add_field(name="Closed DMs cached", value=len(self.dm_queue.closed), inline=True)
+        await ctx.send(embed=embed)
 
 
 def setup(client):
@@ -1,8 +1,12 @@
 import discord
 import datetime
+import io
 from datetime import datetime
 from discord.ext import commands
 
+#Bulk deletes with more cached messages than this are attached as a file
+BULK_INLINE_LIMIT = 10
+
 class Logs(commands.Cog):
 
     def __init__(self, client):
@@ -68,18 +72,23 @@ class Logs(commands.Cog):
         joinEmbed.add_field(name='Joined Server', value=member.joined_at.strftime("%Y-%m-%d %H:%M:%S"))
         joinEmbed.add_field(name='Joined Discord', value=member.created_at.strftime("%Y-%m-%d %H:%M:%S"))
         joinEmbed.set_footer(text=f"ID: {member.id}")
-        await self.client.botLogChannel.send(embed=joinEmbed)
+        self.client.logSink.send(embed=joinEmbed)
 
     @commands.Cog.listener()
     async def on_member_remove(self, member):
         removeEmbed=discord.Embed(title="__** Member Left**__", description="Member: "+member.name+" ("+member.mention+")", color=0xf4a701)
         removeEmbed.set_footer(text="Left at: "+str(datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-        await self.client.botLogChannel.send(embed=removeEmbed)
+        self.client.logSink.send(embed=removeEmbed)
 
     @commands.Cog.listener()
     async def on_message_delete(self, message):
 
-        await self.client.botLogChannel.send(embed=self.message_logs(message))
+        if message.id in self.client.purgedMessages:
+            self.client.purgedMessages.discard(message.id)
+            return
+        embed = self.message_logs(message)
+        if embed:
+            self.client.logSink.send(embed=embed)
 
     @commands.Cog.listener()
     async def on_message_edit(self, before, after):
@@ -87,7 +96,120 @@ class Logs(commands.Cog):
         if before.content == after.content:
             return
 
-        await self.client.botLogChannel.send(embed=self.message_logs(after,before))
+        embed = self.message_logs(after,before)
+        if embed:
+            self.client.logSink.send(embed=embed)
+
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload):
+
+        #Cleared with .clearchat, which posts its own archive
+        purged = self.client.purgedMessages
+        if payload.message_ids <= purged:
+            purged.difference_update(payload.message_ids)
+            for message_id in payload.message_ids:
+                self.client.messageCache.pop(message_id)
+            return
+
+        channel = self.client.get_channel(payload.channel_id)
+        embed=discord.Embed(title="__**Bulk Message Delete**__", description=f"{len(payload.message_ids)} messages deleted", color=0xe80202)
+        embed.add_field(name="__Message Channel__", value=channel.mention if channel else str(payload.channel_id), inline=False)
+        embed.set_footer(text="Deleted at: "+str(datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+
+        cached = {message.id: message for message in payload.cached_messages}
+        lines = []
+        for message_id in sorted(payload.message_ids):
+            message = cached.get(message_id)
+            record = self.client.messageCache.pop(message_id)
+            if message is not None:
+                content = message.content if message.content else "[Embedded Message]" if message.embeds else "[No Text]"
+                lines.append(f"{message.created_at.strftime('%Y-%m-%d %H:%M:%S')} {message.author} ({message.author.id}): {content}")
+            elif record is not None:
+                created = discord.utils.snowflake_time(message_id)
+                lines.append(f"{created.strftime('%Y-%m-%d %H:%M:%S')} <@{record.author_id}> ({record.author_id}): {record.content or '[No Text]'}")
+        uncached = len(payload.message_ids) - len(lines)
+        if uncached:
+            embed.add_field(name="__Uncached Messages__", value=f"{uncached} messages were too old to be logged", inline=False)
+
+        file = None
+        text = "\n".join(lines)
+        if len(lines) <= BULK_INLINE_LIMIT and len(text) <= 1024:
+            if text:
+                embed.add_field(name="__Messages__", value=text, inline=False)
+        else:
+            file = discord.File(io.BytesIO(text.encode()), "deleted_messages.txt")
+        self.client.logSink.send(embed=embed, file=file)
+
+    def record_logs(self, title, record, payload, color, content = None):
+        #Log built from a MessageCache record (or nothing) when discord.py no longer had the message
+        embed=discord.Embed(title=title, color=color)
+        if record is not None:
+            embed.description = f"Message Author: <@{record.author_id}>"
+        embed.add_field(name="__Message Channel__", value=f"<#{payload.channel_id}>", inline=False)
+        if record is None:
+            embed.add_field(name="__Message Content__", value="[Message was sent before the bot's cache]", inline=False)
+        elif content is not None:
+            embed.add_field(name="__Message Before__", value=record.content or "[No Text]", inline=False)
+        elif record.content:
+            embed.add_field(name="__Message Content__", value=record.content, inline=False)
+        if content is not None:
+            embed.add_field(name="__Message After__", value=content or "[No Text]", inline=False)
+        if record is not None and record.attachments:
+            embed.add_field(name=f"__Message Attachments: {len(record.attachments)}__", value="\n".join(record.attachments)[:1024], inline=False)
+        embed.set_footer(text=f"Message ID: {payload.message_id}")
+        return embed
+
+    @commands.Cog.listener()
+    async def on_message(self, message):
+
+        if not isinstance(message.channel, discord.channel.DMChannel):
+            self.client.messageCache.add(message)
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload):
+
+        record = self.client.messageCache.pop(payload.message_id)
+        #Cached by discord.py as well, so on_message_delete logs it
+        if payload.cached_message is not None or payload.guild_id is None:
+            return
+        if payload.message_id in self.client.purgedMessages:
+            self.client.purgedMessages.discard(payload.message_id)
+            return
+        embed = self.record_logs("__**Message Deleted**__", record, payload, 0xe80202)
+        embed.timestamp = datetime.utcnow()
+        self.client.logSink.send(embed=embed)
+
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload):
+
+        content = payload.data.get("content")
+        #Embed-only updates such as link previews carry no content
+        if content is None:
+            return
+        record = self.client.messageCache.get(payload.message_id)
+        before = record.content if record is not None else None
+        if record is not None:
+            record.content = content
+        if payload.cached_message is not None or payload.guild_id is None or before == content:
+            return
+        embed = self.record_logs("__**Message Edited**__", record, payload, 0xe7ec11, content)
+        embed.url = f"https://discord.com/channels/{payload.guild_id}/{payload.channel_id}/{payload.message_id}"
+        embed.timestamp = datetime.utcnow()
+        self.client.logSink.send(embed=embed)
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def cachestats(self, ctx):
+        cache = self.client.messageCache
+        lookups = cache.hits + cache.misses
+        embed=discord.Embed(title="Message Cache", color=0xe7ec11)
+        embed.add_field(name="Messages", value=f"{len(cache)}/{cache.max_messages}", inline=True)
+        embed.add_field(name="Max age", value=f"{cache.max_age // 3600} hours", inline=True)
+        embed.add_field(name="Memory", value=f"{cache.memory_usage() / 1024:.0f} KiB", inline=True)
+        embed.add_field(name="Hits", value=cache.hits, inline=True)
+        embed.add_field(name="Misses", value=cache.misses, inline=True)
+        embed.add_field(name="Hit rate", value=f"{cache.hits / lookups:.1%}" if lookups else "n/a", inline=True)
+        await ctx.send(embed=embed)
 
 def setup(client):
     client.add_cog(Logs(client))
@@ -1,62 +1,54 @@
-import discord, random
+import discord
 from discord.ext import commands
+from utils.extensions import take_state
+from utils.responders import ResponderEngine
 
 class Meme(commands.Cog):
 
     def __init__(self, client):
         self.client = client
-        self.rat_fact = ("Rats eat almost anything. They like meat, grain, seeds, fruit and vegetables.",
-        "Norway rats are big and aggressive. They fight with each other and will even attack humans.",
-        "Rats have sharp teeth that constantly grow. They chew on wood to keep the teeth short and sharp.",
-        "Pet rats live about 3 years.",
-        "Rats can have up to 20 babies at once.",
-        "Rats have a good memory and sense of taste. They can recognize and remember the taste of rat poison.",
-        "Rats are Rats",
-        "The y have legs",
-        "U are a rat",
-        "skree skree",
-        "Cinderblock: Hard white or gray blocks used in buildings",
-        "Question: Are rats useful? Answer: Rats have been used to develop medical cures.",
-        "Thanks to their body shape, rats are able to fit through the tiniest holes and gaps. Their bodies are long and flexible so they can squeeze themselves down to fit into spaces much smaller than themselves!",
-        "A rat’s front teeth are always growing, so they need things to chew on (otherwise it could cause a lot of painful problems for them). It’s super important to feed them the right diet to keep their teeth in good condition – you can read more advice on this. Their teeth are super strong, too, and wild rats have even been known to chew through some metals!",
-        "Unlike us, rats don’t get sweaty pits. Nor do they pant like some other animals. They only have sweat glands on the skin of their paws (which isn’t enough to cool them down). Instead, they use their naked tails to help regulate their body temperatures.",
-        "So we wouldn’t recommend forcing your rat to take a dip, but some rats are known to love water and be really strong swimmers. There are some types that can swim over a mile at once!",
-        "In Ancient Rome, rats were actually considered lucky. Ancient Egyptians and Mayans even worshipped rats. Not sure how that worked alongside worshipping cats, but there you go.",
-        "rats dont usually like rats",
-        "sorry we're out of facts come back later :)",
-        "If you have pet rats, you should always have more than one. They hate to be alone and while they do bond with their owners, they need the company of other rats to stay happy. Best to keep the same gender together though to avoid any unplanned baby rats!",
-        "A group of rats is called a mischief.",
-        "https://www.automatictrap.com/pages/101-rat-facts",
-        "A kangaroo rat can go its average 10-year life span without any water.",
-        "When Pixar created the 2007 film Ratatouille, the animators kept rats in their offices to bring their likeness to life with greater accuracy.",
-        "Rats make sounds similar to laughter when they are happy.")
-
-    @commands.Cog.listener()
-    async def on_message(self, message):
-        if message.author.bot:
+        #Triggers, responses and cooldowns live in the rule file, reload with .responders reload
+        self.engine = take_state(client, "Meme") or ResponderEngine(client, "data/responders.json")
+        self.handed_off = False
+        self.loading = self.client.loop.create_task(self.engine.reload())
+        self.loading.add_done_callback(self.rules_loaded)
+
+    def rules_loaded(self, task):
+        if task.cancelled() or task.exception() is None:
             return
-
-        if isinstance(message.channel, discord.channel.DMChannel):
-            return
-
-        if message.content.startswith("."):
+        error = task.exception()
+        if self.engine.rules:
+            #Handed over from before a reload, those rules are still installed
+            self.client.logSink.send(f"Responder rules not loaded, keeping the current rules: {error!r}")
             return
-
-        if message.embeds:
+        self.client.logSink.send(f"Responder rules not loaded, using the last ones that loaded: {error!r}")
+        self.client.loop.create_task(self.engine.restore())
+
+    def export_state(self):
+        #Keeps cooldowns and counters, the rules are re-read on load
+        self.handed_off = True
+        return self.engine
+
+    def cog_unload(self):
+        if not self.handed_off:
+            self.engine.close()
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def responders(self, ctx, option = "list"):
+        if option == "reload":
+            try:
+                count = await self.engine.reload()
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                await ctx.send(f"Rule file not loaded, keeping the current rules: {e}")
+                return
+            await ctx.send(f"Reloaded {count} responder rules.")
             return
 
-        if "rat fact" in message.content.lower():
-            i = random.randrange(len(self.rat_fact))
-            await message.author.send(f"{self.rat_fact[i]}")
-
-        elif "hello there" in message.content.lower():
-            await message.author.send("https://tenor.com/view/grevious-general-kenobi-star-wars-gif-11406339")
-
-        elif "beans" in message.content.lower():
-            beans = discord.Embed()
-            beans.set_image(url="https://i.imgur.com/GkyCNCH.jpg")
-            beans.set_footer(text="You thought i was gone? Shh")
-            await message.author.send(embed=beans)
+        embed=discord.Embed(title="Responders", description=f"{self.engine.fired} responses sent, {self.engine.suppressed} held back by cooldowns", color=0xe7ec11)
+        for rule in self.engine.all_rules()[:25]:
+            embed.add_field(name=rule.name, value=f"'{rule.trigger}' -> {rule.scope}, {rule.cooldown:g}s cooldown per {'channel' if rule.per_channel else 'user'}", inline=False)
+        await ctx.send(embed=embed)
 
 def setup(client):
     client.add_cog(Meme(client))
@@ -0,0 +1,59 @@
+import discord
+import datetime
+from discord.ext import commands
+
+#Rows shown per section, each section is one embed field
+SECTION_ROWS = 8
+SECTIONS = {
+    "commands": ("command", "Commands"),
+    "listeners": ("listener", "Listeners"),
+    "handlers": ("handler", "Message handlers"),
+    "api": ("api", "API calls"),
+}
+
+class Metrics(commands.Cog):
+
+    def __init__(self, client):
+        self.client = client
+
+    def render(self, kind, limit):
+        lines = []
+        for name, histogram in self.client.metrics.top(kind, limit):
+            p50, p95 = histogram.quantile(0.5) * 1000, histogram.quantile(0.95) * 1000
+            errors = f" {histogram.errors}err" if histogram.errors else ""
+            lines.append(f"{name[:40]}: {histogram.count}x p50 {p50:.0f} p95 {p95:.0f} max {histogram.max * 1000:.0f}ms{errors}")
+        #Field values are capped at 1024 characters
+        value = ""
+        for line in lines:
+            if len(value) + len(line) + 8 > 1024:
+                break
+            value += line + "\n"
+        return f"```{value}```" if value else "None yet"
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def metrics(self, ctx, section = None):
+        metrics = self.client.metrics
+        since = datetime.datetime.fromtimestamp(metrics.since).strftime('%Y-%m-%d %H:%M:%S')
+
+        if section and section.lower() == "reset":
+            metrics.reset()
+            await ctx.send("**Metrics reset**")
+            return
+
+        embed=discord.Embed(title="Metrics", description=f"Since {since}, sorted by total time", color=0xe7ec11)
+        if section and section.lower() in SECTIONS:
+            kind, title = SECTIONS[section.lower()]
+            embed.add_field(name=title, value=self.render(kind, None), inline=False)
+        elif section:
+            embed.add_field(name="Option Unknown", value="Try 'commands', 'listeners', 'handlers', 'api' or 'reset'", inline=False)
+        else:
+            for kind, title in SECTIONS.values():
+                embed.add_field(name=title, value=self.render(kind, SECTION_ROWS), inline=False)
+            limits = metrics.rate_limits.most_common(SECTION_ROWS)
+            embed.add_field(name="Rate limits", value="\n".join(f"{path} ({kind}): {count}" for (kind, path), count in limits) or "None", inline=False)
+        await ctx.send(embed=embed)
+
+
+def setup(client):
+    client.add_cog(Metrics(client))
@@ -1,6 +1,13 @@
-import discord, json, os
+import discord, time
 from discord.ext import commands
 from discord import RawReactionActionEvent
+from utils.extensions import take_state
+from utils.rollover import RolloverEngine
+
+#Seconds an unfinished reaction role menu is kept after its last change
+RR_SESSION_TTL = 3600
+RR_SETTINGS = ("ID", "multiple", "title")
+YEAR_ROLES = ('First Year', 'Second Year', 'Third Year', 'Placement Year', 'Fourth Year', 'Alumni', 'Placement')
 
 async def command_channels(ctx):
     return ctx.channel.id in (517651663729852416, 505476463492071425)
@@ -16,65 +23,143 @@ async def is_admin(ctx):
 class Roles(commands.Cog):
     def __init__(self, client):
         self.client = client
-        with open("data/reaction_roles_data.json") as file:
-            self.data = json.load(file)
+        self.data = {}
+        self.reaction_index = {}
+        self.exclusive_menus = {}
+        state = take_state(client, "Roles") or {}
+        #(message ID, user ID) -> emoji of the user's current pick on an exclusive menu
+        self.selections = state.get("selections", {})
+        #(message ID, user ID, emoji name) of reactions the bot is removing itself
+        self.bot_removals = state.get("bot_removals", set())
+        self.rollover_engine = None
+        #Author ID -> {"expires": timestamp, "menu": settings and emoji -> role ID}
+        self.rr_sessions = {}
+        self.loaded = client.loop.create_task(self.load())
+
+    async def load(self):
+        self.data = await self.client.storage.load_reaction_menus()
+        self.rr_sessions = await self.client.storage.load_sessions()
+        self.build_index()
+
+    def export_state(self):
+        return {"selections": self.selections, "bot_removals": self.bot_removals}
+
+    def build_index(self):
+        #(message ID, emoji name) -> role ID, and message ID -> whether only one role can be picked
+        self.reaction_index = {}
+        self.exclusive_menus = {}
+        for message_id, menu in self.data.items():
+            self.index_menu(int(message_id), menu)
+
+    def index_menu(self, message_id, menu):
+        self.exclusive_menus[message_id] = not menu["multiple"]
+        for emoji_name, role_id in menu.items():
+            if emoji_name != "multiple":
+                self.reaction_index[(message_id, emoji_name)] = role_id
+
+    async def remove_reaction(self, guild, payload, emoji):
+        self.bot_removals.add((payload.message_id, payload.user_id, emoji.name))
+        message = guild.get_channel(payload.channel_id).get_partial_message(payload.message_id)
+        try:
+            await message.remove_reaction(emoji, payload.member)
+        except discord.HTTPException:
+            self.bot_removals.discard((payload.message_id, payload.user_id, emoji.name))
+
+    async def replace_selection(self, guild, payload):
+        key = (payload.message_id, payload.user_id)
+        previous = self.selections.get(key)
+        self.selections[key] = payload.emoji
+
+        if previous is not None:
+            stale = [previous] if previous.name != payload.emoji.name else []
+        else:
+            #Nothing tracked yet (e.g. after a restart), so go by the menu roles the member already has
+            stale = []
+            held = {role.id for role in payload.member.roles}
+            for (message_id, emoji_name), role_id in self.reaction_index.items():
+                if message_id == payload.message_id and emoji_name != payload.emoji.name and role_id in held:
+                    emoji = discord.utils.get(guild.emojis, name=emoji_name)
+                    if emoji is not None:
+                        stale.append(emoji)
+
+        stale_roles = [guild.get_role(self.reaction_index[(payload.message_id, emoji.name)]) for emoji in stale]
+        stale_roles = [role for role in stale_roles if role is not None]
+        if stale_roles:
+            await payload.member.remove_roles(*stale_roles)
+        for emoji in stale:
+            await self.remove_reaction(guild, payload, emoji)
 
     @commands.Cog.listener()
     async def on_raw_reaction_add(self, payload: RawReactionActionEvent):
-        if payload.user_id != self.client.user.id: 
-            for message in self.data:
-                if int(message) == payload.message_id:
-                    for reaction in self.data[message]:
-                        if reaction == payload.emoji.name:
-                            guild = discord.utils.get(self.client.guilds, id=payload.guild_id)
-                            role = discord.utils.get(guild.roles, id=self.data[message][reaction])
-                            await payload.member.add_roles(role)
-
-                            if self.data[message]["multiple"] is False:
-                                channel = discord.utils.get(guild.channels, id=payload.channel_id)
-                                all_msg = await channel.history(limit=100).flatten()
-                                msg = discord.utils.get(all_msg, id=payload.message_id)
-                                for react in msg.reactions:
-                                    if payload.emoji.name not in str(react.emoji):
-                                        rem_role = discord.utils.get(guild.roles, id=self.data[message][react.emoji.name])
-                                        await payload.member.remove_roles(rem_role)
-                                        async for user in react.users():
-                                            if user.id == payload.user_id:
-                                                await react.remove(payload.member)
-                            return
-                    guild = discord.utils.get(self.client.guilds, id=payload.guild_id)
-                    channel = discord.utils.get(guild.channels, id=payload.channel_id)
-                    all_msg = await channel.history(limit=100).flatten()
-                    msg = discord.utils.get(all_msg, id=payload.message_id)
-                    for react in msg.reactions:
-                        if payload.emoji.name in str(react.emoji):
-                            async for user in react.users():
-                                if user.id == payload.user_id:
-                                    await react.remove(payload.member)
+        await self.loaded
+        exclusive = self.exclusive_menus.get(payload.message_id)
+        if exclusive is None or payload.user_id == self.client.user.id:
+            return
+
+        guild = self.client.get_guild(payload.guild_id)
+        role_id = self.reaction_index.get((payload.message_id, payload.emoji.name))
+        if role_id is None:
+            await self.remove_reaction(guild, payload, payload.emoji)
+            return
+
+        await payload.member.add_roles(guild.get_role(role_id))
+        if exclusive:
+            await self.replace_selection(guild, payload)
 
     @commands.Cog.listener()
     async def on_raw_reaction_remove(self, payload: RawReactionActionEvent):
-        if payload.user_id != self.client.user.id:
-            for message in self.data:
-                if int(message) == payload.message_id:
-                    for reaction in self.data[message]:
-                        if reaction == payload.emoji.name:
-                            guild = discord.utils.get(self.client.guilds, id=payload.guild_id)
-                            user = discord.utils.get(guild.members, id=payload.user_id)
-                            role = discord.utils.get(guild.roles, id=self.data[message][reaction])
-                            await user.remove_roles(role)
+        await self.loaded
+        #Checked first so removals of emojis that aren't on the menu are forgotten too
+        removal = (payload.message_id, payload.user_id, payload.emoji.name)
+        if removal in self.bot_removals:
+            #The role was already taken away when the bot removed this reaction
+            self.bot_removals.discard(removal)
+            return
+
+        role_id = self.reaction_index.get((payload.message_id, payload.emoji.name))
+        if role_id is None or payload.user_id == self.client.user.id:
+            return
+
+        key = (payload.message_id, payload.user_id)
+        selected = self.selections.get(key)
+        if selected is not None and selected.name == payload.emoji.name:
+            del self.selections[key]
+
+        guild = self.client.get_guild(payload.guild_id)
+        user = guild.get_member(payload.user_id)
+        if user is not None:
+            await user.remove_roles(guild.get_role(role_id))
+
 
+    def get_session(self, author_id):
+        session = self.rr_sessions.get(author_id)
+        if session is None:
+            return None
+        if session["expires"] < time.time():
+            self.end_session(author_id)
+            return None
+        return session["menu"]
+
+    def update_session(self, author_id, menu):
+        session = self.rr_sessions[author_id] = {"expires": time.time() + RR_SESSION_TTL, "menu": menu}
+        self.client.storage.save_session(author_id, session)
+
+    def end_session(self, author_id):
+        self.rr_sessions.pop(author_id, None)
+        self.client.storage.delete_session(author_id)
 
     @commands.command(hidden=True)
     @commands.has_role("Committee")
     async def rr(self, ctx, *args):
+        await self.loaded
+        author_id = str(ctx.author.id)
+        temp = self.get_session(author_id)
+
         if args[0] == "start":
-            if os.path.isfile("data/temp.json"):
+            if temp is not None:
                 await ctx.send("You are already working on a new reaction role menu. You can check progress by typing '.rr check'")
             else:
-                temp = {}
-                with open("data/temp.json", "w") as file:
-                    json.dump(temp, file)
+                self.update_session(author_id, {})
                 await ctx.send("Started creating a reaction role menu, here are your options:\n"
                                "(Only use custom emojis as it won't work with unicode ones)\n"
                                "```\n"
@@ -86,129 +171,98 @@ class Roles(commands.Cog):
                                ".rr cancel - cancels the reaction role menu creation\n"
                                ".rr finish - finishes the reaction role menu creation and posts the message\n"
                                "```")
+        elif args[0] not in ("channel", "multiple", "title", "reaction", "check", "cancel", "finish"):
+            await ctx.send("Invalid choice!")
+        elif temp is None:
+            await ctx.send("You aren't working on a reaction roles menu. To start type '.rr start'")
         elif args[0] == "channel":
-            if not os.path.isfile("data/temp.json"):
-                await ctx.send("You aren't working on a reaction roles menu. To start type '.rr start'")
-            else:
-                try:
-                    channel = discord.utils.get(ctx.guild.channels, id=int(args[1]))
-                    with open("data/temp.json", "r") as file:
-                        temp = json.load(file)
+            try:
+                channel = discord.utils.get(ctx.guild.channels, id=int(args[1]))
+                if temp.get("ID") != channel.id:
                     temp["ID"] = channel.id
-                    with open("data/temp.json", "w") as file:
-                        json.dump(temp, file)
-
-                    await ctx.send("You've chosen the channel: " + channel.name)
-                except:
-                    await ctx.send("Incorrect channel ID, please try again")
+                    self.update_session(author_id, temp)
+                await ctx.send("You've chosen the channel: " + channel.name)
+            except:
+                await ctx.send("Incorrect channel ID, please try again")
         elif args[0] == "multiple":
-            if not os.path.isfile("data/temp.json"):
-                await ctx.send("You aren't working on a reaction roles menu. To start type '.rr start'")
+            if len(args) > 1 and args[1] == "true":
+                decision = True
+            elif len(args) > 1 and args[1] == "false":
+                decision = False
             else:
-                if args[1] == "true":
-                    decision = True
-                elif args[1] == "false":
-                    decision = False
-                else:
-                    await ctx.send("Invalid choice, it's either true or false")
-                    return
-
-                with open("data/temp.json", "r") as file:
-                    temp = json.load(file)
+                await ctx.send("Invalid choice, it's either true or false")
+                return
+
+            if temp.get("multiple") != decision:
                 temp["multiple"] = decision
-                with open("data/temp.json", "w") as file:
-                    json.dump(temp, file)
-                await ctx.send("You have set multiple: " + str(decision))
+                self.update_session(author_id, temp)
+            await ctx.send("You have set multiple: " + str(decision))
         elif args[0] == "title":
-            if not os.path.isfile("data/temp.json"):
-                await ctx.send("You aren't working on a reaction roles menu. To start type '.rr start'")
-            else:
-                try:
-                    title = " ".join(args[1:len(args)])
-                    with open("data/temp.json", "r") as file:
-                        temp = json.load(file)
-                    temp["title"] = title
-                    with open("data/temp.json", "w") as file:
-                        json.dump(temp, file)
-                    await ctx.send("You have set the title to: " + title)
-                except:
-                    await ctx.send("No title provided")
+            title = " ".join(args[1:len(args)])
+            if not title:
+                await ctx.send("No title provided")
+                return
+            if temp.get("title") != title:
+                temp["title"] = title
+                self.update_session(author_id, temp)
+            await ctx.send("You have set the title to: " + title)
         elif args[0] == "reaction":
-            if not os.path.isfile("data/temp.json"):
-                await ctx.send("You aren't working on a reaction roles menu. To start type '.rr start'")
-            else:
-                try:
-                    emoji_name = args[1][2:len(args[1])-20]
-                    role = int(args[2])
-                    with open("data/temp.json", "r") as file:
-                        temp = json.load(file)
+            try:
+                emoji_name = args[1][2:len(args[1])-20]
+                role = int(args[2])
+                role_obj = ctx.guild.get_role(role)
+                if temp.get(emoji_name) != role:
                     temp[emoji_name] = role
-                    with open("data/temp.json", "w") as file:
-                        json.dump(temp, file)
-
-                    role_obj = discord.utils.get(ctx.guild.roles, id=role)
-                    await ctx.send("You have set " + args[1] + " to give the role - " + role_obj.name)
-                except:
-                    await ctx.send("Incorrect emoji and role provided.")
+                    self.update_session(author_id, temp)
+                await ctx.send("You have set " + args[1] + " to give the role - " + role_obj.name)
+            except:
+                await ctx.send("Incorrect emoji and role provided.")
         elif args[0] == "check":
-            if not os.path.isfile("data/temp.json"):
-                await ctx.send("You aren't working on a reaction roles menu. To start type '.rr start'")
-            else:
-                with open("data/temp.json") as file:
-                    temp = json.load(file)
-
-                string = "You currently have:\n```\n"
-                for item in temp:
-                    string += str(item) + ": " + str(temp[item]) + "\n"
-                string += "```"
-                await ctx.send(string)
+            string = "You currently have:\n```\n"
+            for item in temp:
+                string += str(item) + ": " + str(temp[item]) + "\n"
+            string += "```"
+            await ctx.send(string)
         elif args[0] == "cancel":
-            if not os.path.isfile("data/temp.json"):
-                await ctx.send("You aren't working on a reaction roles menu. To start type '.rr start'")
-            else:
-                os.remove("data/temp.json")
-                await ctx.send("You have stopped creating a reaction roles menu.")
+            self.end_session(author_id)
+            await ctx.send("You have stopped creating a reaction roles menu.")
         elif args[0] == "finish":
-            if not os.path.isfile("data/temp.json"):
-                await ctx.send("You aren't working on a reaction roles menu. To start type '.rr start'")
+            missing = [setting for setting in RR_SETTINGS if setting not in temp]
+            if missing:
+                await ctx.send("You still need to set: " + ", ".join(missing))
+                return
+
+            message_channel = ctx.guild.get_channel(temp["ID"])
+            emoji_roles = ""
+            emojis = []
+            for item in temp:
+                if item not in RR_SETTINGS:
+                    role = ctx.guild.get_role(temp[item])
+                    emoji = discord.utils.get(ctx.guild.emojis, name=item)
+                    emoji_roles += str(emoji) + ": " + role.name + "\n"
+                    emojis.append(emoji)
+            if temp["multiple"]:
+                main_message = discord.Embed(title="Select roles for:", color=0xe7ec11)
             else:
-                with open("data/temp.json") as file:
-                    temp = json.load(file)
-
-                message_channel = discord.utils.get(ctx.guild.channels, id=temp["ID"])
-                emoji_roles = ""
-                for item in temp:
-                    if item != "ID" and item != "multiple" and item != "title":
-                        role = discord.utils.get(ctx.guild.roles, id=temp[item])
-                        emoji = discord.utils.get(ctx.guild.emojis, name=item)
-                        emoji_roles += str(emoji) + ": " + role.name + "\n"
-                if temp["multiple"]:
-                    main_message = discord.Embed(title="Select roles for:", color=0xe7ec11)
-                else:
-                    main_message = discord.Embed(title="Select role for:", color=0xe7ec11)
-                main_message.add_field(name=temp["title"], value=emoji_roles, inline=False)
-                main_message.set_footer(text="Feature developed by Emi/Peter")
-
-                rr_message = await message_channel.send(embed=main_message)
-                for item in temp:
-                    if item != "ID" and item != "multiple" and item != "title":
-                        emoji = discord.utils.get(ctx.guild.emojis, name=item)
-                        await rr_message.add_reaction(emoji)
-
-                self.data[str(rr_message.id)] = {}
-                self.data[str(rr_message.id)]["multiple"] = temp["multiple"]
-                for item in temp:
-                    if item != "ID" and item != "multiple" and item != "title":
-                        self.data[str(rr_message.id)][item] = temp[item]
-                with open("data/reaction_roles_data.json", "w") as file:
-                    json.dump(self.data, file)
-
-                await ctx.send("Successfully created the reaction roles menu message. Please upload this JSON file to the githubs data folder to save your changes!")
-                await ctx.send(file=discord.File("data/reaction_roles_data.json"))
-
-                os.remove("data/temp.json")
-        else:
-            await ctx.send("Invalid choice!")
+                main_message = discord.Embed(title="Select role for:", color=0xe7ec11)
+            main_message.add_field(name=temp["title"], value=emoji_roles, inline=False)
+            main_message.set_footer(text="Feature developed by Emi/Peter")
+
+            rr_message = await message_channel.send(embed=main_message)
+            #One at a time so the reactions are in the same order as the menu's lines
+            for emoji in emojis:
+                await rr_message.add_reaction(emoji)
+
+            self.data[str(rr_message.id)] = {}
+            self.data[str(rr_message.id)]["multiple"] = temp["multiple"]
+            for item in temp:
+                if item not in RR_SETTINGS:
+                    self.data[str(rr_message.id)][item] = temp[item]
+            self.index_menu(rr_message.id, self.data[str(rr_message.id)])
+            self.client.storage.save_reaction_menu(rr_message.id, self.data[str(rr_message.id)])
+
+            self.end_session(author_id)
+            await ctx.send("Successfully created the reaction roles menu message.")
 
 
     @commands.command()
@@ -302,76 +356,87 @@ class Roles(commands.Cog):
     @commands.command(hidden=True)
     @commands.check(command_channels)
     @commands.check(is_admin)
-    async def updateroles(self, ctx):
-        await ctx.send('Updating roles, please wait...')
-        await self.update_roles(ctx)
-        await ctx.send('Manually updated roles!')
+    async def updateroles(self, ctx, option = None):
+        await self.rollover(ctx, "update", option)
 
     @commands.command(hidden=True)
     @commands.check(command_channels)
     @commands.check(is_admin)
-    async def woopslemmejustrevertdemroles(self, ctx):
-        await ctx.send('Reverting roles, please wait...')
-        await self.revert_roles(ctx)
-        await ctx.send('Manually reverted roles!')
-
-    async def update_roles(self, ctx):
-        for guild in self.client.guilds:
-            self.first_year = discord.utils.get(guild.roles, name='First Year')
-            self.second_year = discord.utils.get(guild.roles, name='Second Year')
-            self.third_year = discord.utils.get(guild.roles, name='Third Year')
-            self.placement_year = discord.utils.get(guild.roles, name='Placement Year')
-            self.fourth_year = discord.utils.get(guild.roles, name='Fourth Year')
-            self.alumni = discord.utils.get(guild.roles, name='Alumni')
-            self.placement = discord.utils.get(guild.roles, name='Placement')
-            i = 0 # lazi logging
-            for member in guild.members:
-                i += 1
-                if i % 20 == 0:
-                    await ctx.send(f'Updated {i} roles...')
-                if self.first_year in member.roles:
-                    await member.remove_roles(self.first_year)
-                    await member.add_roles(self.second_year)
-                elif self.second_year in member.roles:
-                    await member.remove_roles(self.second_year)
-                    if self.placement in member.roles:
-                        await member.add_roles(self.placement_year)
-                    else:
-                        await member.add_roles(self.third_year)
-                elif self.third_year in member.roles:
-                    await member.remove_roles(self.third_year)
-                    await member.add_roles(self.alumni)
-                elif self.placement_year in member.roles:
-                    await member.remove_roles(self.placement_year)
-                    await member.add_roles(self.fourth_year)
-                elif self.fourth_year in member.roles:
-                    await member.remove_roles(self.fourth_year)
-                    await member.add_roles(self.alumni)
-                    
-    async def revert_roles(self, ctx):
-        for guild in self.client.guilds:
-            self.first_year = discord.utils.get(guild.roles, name='First Year')
-            self.second_year = discord.utils.get(guild.roles, name='Second Year')
-            self.third_year = discord.utils.get(guild.roles, name='Third Year')
-            self.placement_year = discord.utils.get(guild.roles, name='Placement Year')
-            self.fourth_year = discord.utils.get(guild.roles, name='Fourth Year')
-            i = 0 # lazi logging
-            for member in guild.members:
-                i += 1
-                if i % 20 == 0:
-                    await ctx.send(f'Reverted {i} roles...')
-                if self.second_year in member.roles:
-                    await member.remove_roles(self.second_year)
-                    await member.add_roles(self.first_year)
-                elif self.third_year in member.roles:
-                    await member.remove_roles(self.third_year)
-                    await member.add_roles(self.second_year)
-                elif self.placement_year in member.roles:
-                    await member.remove_roles(self.placement_year)
-                    await member.add_roles(self.second_year)
-                elif self.fourth_year in member.roles:
-                    await member.remove_roles(self.fourth_year)
-                    await member.add_roles(self.placement_year)
+    async def woopslemmejustrevertdemroles(self, ctx, option = None):
+        await self.rollover(ctx, "revert", option)
+
+    async def rollover(self, ctx, kind, option):
+        if self.rollover_engine is not None:
+            await ctx.send(self.rollover_engine.progress())
+            return
+
+        if option == "cancel":
+            RolloverEngine.clear_checkpoint(self.client.storage)
+            await ctx.send('Cleared any interrupted role update or revert.')
+            return
+
+        engine = await RolloverEngine.load_checkpoint(ctx.guild, self.client.storage)
+        if engine is not None and engine.kind != kind:
+            await ctx.send(f'An interrupted role {engine.kind} has not finished yet. Run it again to resume it, or add "cancel" to drop it.')
+            return
+        if engine is None:
+            engine = RolloverEngine(ctx.guild, kind, self.plan_rollover(ctx.guild, kind), self.client.storage)
+
+        if option == "dry":
+            embed=discord.Embed(title=f"Role {kind} - dry run", description=f"{engine.remaining()} of {len(engine.plan)} planned members still to change", color=0xe7ec11)
+            for change, count in engine.summary().most_common(25):
+                embed.add_field(name=change, value=f"{count} members", inline=False)
+            await ctx.send(embed=embed)
+            return
+
+        if engine.done:
+            await ctx.send(f'Resuming the interrupted role {kind}, {engine.remaining()} members left...')
+        else:
+            await ctx.send('Updating roles, please wait...' if kind == "update" else 'Reverting roles, please wait...')
+        status = await ctx.send(engine.progress())
+        self.rollover_engine = engine
+        try:
+            await engine.run(status)
+        finally:
+            self.rollover_engine = None
+        if engine.failed:
+            await ctx.send(f'{engine.failed} members could not be changed, run the command again to retry them.')
+        else:
+            await ctx.send('Manually updated roles!' if kind == "update" else 'Manually reverted roles!')
+
+    def plan_rollover(self, guild, kind):
+        roles = {name: discord.utils.get(guild.roles, name=name) for name in YEAR_ROLES}
+        transition = self.update_transition if kind == "update" else self.revert_transition
+        plan = []
+        for member in guild.members:
+            change = transition(roles, member.roles)
+            if change and None not in change:
+                plan.append([member.id, [change[0].id], [change[1].id]])
+        return plan
+
+    def update_transition(self, roles, held):
+        if roles['First Year'] in held:
+            return roles['First Year'], roles['Second Year']
+        elif roles['Second Year'] in held:
+            if roles['Placement'] in held:
+                return roles['Second Year'], roles['Placement Year']
+            return roles['Second Year'], roles['Third Year']
+        elif roles['Third Year'] in held:
+            return roles['Third Year'], roles['Alumni']
+        elif roles['Placement Year'] in held:
+            return roles['Placement Year'], roles['Fourth Year']
+        elif roles['Fourth Year'] in held:
+            return roles['Fourth Year'], roles['Alumni']
+
+    def revert_transition(self, roles, held):
+        if roles['Second Year'] in held:
+            return roles['Second Year'], roles['First Year']
+        elif roles['Third Year'] in held:
+            return roles['Third Year'], roles['Second Year']
+        elif roles['Placement Year'] in held:
+            return roles['Placement Year'], roles['Second Year']
+        elif roles['Fourth Year'] in held:
+            return roles['Fourth Year'], roles['Placement Year']
 
 
 def setup(client):
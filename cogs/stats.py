@@ -1,5 +1,5 @@
 import discord
-import time
+from datetime import datetime
 from discord.ext import commands
 
 async def is_admin(ctx):
@@ -12,15 +12,10 @@ class Stats(commands.Cog, command_attrs=dict(hidden=True)):
 
     def __init__(self, client):
         self.client = client
-        self.timestamp = time.time()
 
     @commands.command()
     @commands.check(is_admin)
     async def room(self, ctx, status = None):
-        if time.time() - self.timestamp <= 300:
-            await ctx.send(f"**Please wait 5 minutes before trying again**")
-            return
-
         if not status:
             return
 
@@ -29,9 +24,13 @@ class Stats(commands.Cog, command_attrs=dict(hidden=True)):
         elif status.lower() in ("closed", "close", "c"):
             status = "Closed"
 
-        await self.client.roomChannel.edit(name=f"DevSoc Room: {status}")
-        await ctx.send(f"Room Status: **{status}**")
-        self.timestamp = time.time()
+        await self.client.channelsReady.wait()
+        #Renames are limited to two per 10 minutes, so the latest status is applied when allowed
+        when = self.client.channelStatus.set(self.client.roomChannel, f"DevSoc Room: {status}")
+        if when is None:
+            await ctx.send(f"Room Status: **{status}** (already set)")
+        else:
+            await ctx.send(f"Room Status: **{status}**, queued, will apply at {datetime.fromtimestamp(when).strftime('%H:%M')}")
 
 
             
@@ -0,0 +1,69 @@
+import asyncio
+import time
+import discord
+from collections import deque
+
+
+class ChannelStatusWriter:
+    """Renames status channels within Discord's rename limit.
+
+    Discord allows ``budget`` renames of a channel per ``period`` seconds.
+    ``set`` can be called at any time: the latest name asked for replaces any
+    that is still waiting, and it is applied as soon as that channel's budget
+    allows. A name the channel already has is never sent.
+    """
+
+    def __init__(self, client, budget=2, period=600):
+        self.client = client
+        self.budget = budget
+        self.period = period
+        #Channel ID -> times of its recent renames, and the name waiting to be applied
+        self.renames = {}
+        self.pending = {}
+        self.tasks = {}
+        self.applied = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def next_slot(self, channel_id):
+        """When the channel can next be renamed, as a timestamp."""
+        now = time.time()
+        recent = self.renames.setdefault(channel_id, deque(maxlen=self.budget))
+        if len(recent) < self.budget:
+            return now
+        return max(now, recent[0] + self.period)
+
+    def set(self, channel, name):
+        """Queue a new name. Returns when it will be applied, or None if the channel already has it."""
+        if name == channel.name:
+            #Also drops a different name still waiting, the channel is already where it should end up
+            if self.pending.pop(channel.id, None) is not None:
+                self.skipped += 1
+            return None
+        if channel.id in self.pending:
+            self.skipped += 1
+        self.pending[channel.id] = name
+        if channel.id not in self.tasks:
+            self.tasks[channel.id] = self.client.loop.create_task(self.worker(channel))
+        return self.next_slot(channel.id)
+
+    async def worker(self, channel):
+        try:
+            while channel.id in self.pending:
+                delay = self.next_slot(channel.id) - time.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                name = self.pending.pop(channel.id, None)
+                channel = self.client.get_channel(channel.id) or channel
+                if name is None or name == channel.name:
+                    continue
+                self.renames[channel.id].append(time.time())
+                try:
+                    await channel.edit(name=name)
+                except discord.HTTPException as e:
+                    self.failed += 1
+                    print(f"Could not rename channel {channel.id} to {name}: {e}")
+                else:
+                    self.applied += 1
+        finally:
+            del self.tasks[channel.id]
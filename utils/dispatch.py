@@ -0,0 +1,134 @@
+import asyncio
+import inspect
+import time
+import traceback
+import discord
+from utils.matcher import KeywordMatcher
+
+
+class PreparedMessage:
+    __slots__ = ("message", "edited", "lowered", "tokens", "is_bot", "is_dm", "is_command", "has_embeds")
+
+    def __init__(self, message, edited, prefix):
+        self.message = message
+        self.edited = edited
+        self.lowered = message.content.lower()
+        self.tokens = frozenset(self.lowered.split())
+        self.is_bot = message.author.bot
+        self.is_dm = isinstance(message.channel, discord.channel.DMChannel)
+        self.is_command = message.content.startswith(prefix)
+        self.has_embeds = bool(message.embeds)
+
+
+class Trigger:
+    __slots__ = ("owner", "keyword", "handler", "edits", "embeds")
+
+    def __init__(self, owner, keyword, handler, edits, embeds):
+        self.owner = owner
+        self.keyword = keyword
+        self.handler = handler
+        self.edits = edits
+        self.embeds = embeds
+
+
+class Watcher:
+    __slots__ = ("owner", "callback", "edits", "bots", "commands")
+
+    def __init__(self, owner, callback, edits, bots, commands):
+        self.owner = owner
+        self.callback = callback
+        self.edits = edits
+        self.bots = bots
+        self.commands = commands
+
+
+class MessageRouter:
+    """Single on_message/on_message_edit entry point shared by the cogs.
+
+    Each message is prepared once (lowercased text, token set, filter flags).
+    Watchers receive every prepared message that passes their filters, while
+    keyword triggers are matched together in one pass and each handler is
+    called once with the set of its keywords that matched. DMs, bots and
+    commands never reach triggers. Cogs register in ``__init__`` and call
+    ``remove_owner`` from ``cog_unload``.
+    """
+
+    def __init__(self, client, prefix="."):
+        self.client = client
+        self.prefix = prefix
+        self.triggers = {}
+        self.watchers = []
+        self.matcher = KeywordMatcher()
+
+    def add_trigger(self, owner, keyword, handler, *, edits=False, embeds=True, rebuild=True):
+        """Register a keyword. Pass ``rebuild=False`` when adding many and call ``rebuild`` once after."""
+        keyword = keyword.lower()
+        self.triggers.setdefault(keyword, []).append(Trigger(owner, keyword, handler, edits, embeds))
+        if rebuild:
+            self.rebuild()
+
+    def add_watcher(self, owner, callback, *, edits=False, bots=False, commands=False):
+        self.watchers.append(Watcher(owner, callback, edits, bots, commands))
+
+    def remove_owner(self, owner, *, rebuild=True):
+        for keyword in list(self.triggers):
+            self.triggers[keyword] = [trigger for trigger in self.triggers[keyword] if trigger.owner is not owner]
+            if not self.triggers[keyword]:
+                del self.triggers[keyword]
+        self.watchers = [watcher for watcher in self.watchers if watcher.owner is not owner]
+        if rebuild:
+            self.rebuild()
+
+    def rebuild(self):
+        self.matcher = KeywordMatcher(self.triggers)
+
+    async def on_message(self, message):
+        await self.dispatch(message, False)
+
+    async def on_message_edit(self, before, after):
+        await self.dispatch(after, True)
+
+    async def dispatch(self, message, edited):
+        prepared = PreparedMessage(message, edited, self.prefix)
+
+        #Synchronous watchers run straight away, async ones run alongside the triggers so a slow one
+        #(e.g. a REST call for context) doesn't hold up the replies
+        pending = []
+        for watcher in self.watchers:
+            if edited and not watcher.edits:
+                continue
+            if prepared.is_dm or (prepared.is_bot and not watcher.bots) or (prepared.is_command and not watcher.commands):
+                continue
+            if inspect.iscoroutinefunction(watcher.callback):
+                pending.append((watcher.callback, (prepared,)))
+            else:
+                await self.call(watcher.callback, prepared)
+
+        if not (prepared.is_bot or prepared.is_dm or prepared.is_command):
+            #Handler -> the keywords it owns that appear in the message
+            matched = {}
+            for keyword in self.matcher.find(prepared.lowered):
+                for trigger in self.triggers[keyword]:
+                    if edited and not trigger.edits:
+                        continue
+                    if prepared.has_embeds and not trigger.embeds:
+                        continue
+                    matched.setdefault(trigger.handler, set()).add(keyword)
+            pending.extend((handler, (prepared, keywords)) for handler, keywords in matched.items())
+        if pending:
+            await asyncio.gather(*(self.call(callback, *args) for callback, args in pending))
+
+    async def call(self, callback, *args):
+        start = time.perf_counter()
+        failed = False
+        try:
+            result = callback(*args)
+            if inspect.isawaitable(result):
+                await result
+        except Exception:
+            failed = True
+            print(f"Ignoring exception in message handler {callback.__qualname__}")
+            traceback.print_exc()
+        metrics = getattr(self.client, "metrics", None)
+        if metrics is not None:
+            metrics.observe("handler", callback.__qualname__, time.perf_counter() - start, failed)
@@ -0,0 +1,142 @@
+import asyncio
+import sys
+import time
+import traceback
+import discord
+from collections import OrderedDict
+
+
+class PendingDM:
+    __slots__ = ("user", "due", "items", "overflow")
+
+    def __init__(self, user, due):
+        self.user = user
+        self.due = due
+        self.items = []
+        self.overflow = 0
+
+
+class DMQueue:
+    """Background DM sender that coalesces items per user.
+
+    The first item for a user is sent straight away. No user is messaged more
+    than once per ``cooldown`` seconds, so items arriving during a user's
+    cooldown are delivered together as one DM once it ends. Users whose DMs
+    are closed are skipped for ``closed_ttl`` seconds. ``render`` turns a
+    list of items and an overflow count into an embed.
+    """
+
+    def __init__(self, client, render, cooldown=60, max_pending=500, max_items=5, closed_ttl=6 * 3600):
+        self.client = client
+        self.render = render
+        self.cooldown = cooldown
+        self.max_pending = max_pending
+        self.max_items = max_items
+        self.closed_ttl = closed_ttl
+
+        self.pending = OrderedDict()
+        self.cooldowns = {}
+        self.closed = {}
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+        self.queued = 0
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = self.client.loop.create_task(self.worker())
+            self.task.add_done_callback(self.restart)
+
+    def restart(self, task):
+        #A dead worker would stop every DM, and is handed on to reloaded cogs as it is
+        if task is not self.task:
+            return
+        self.task = None
+        if task.cancelled() or self.client.is_closed():
+            return
+        if task.exception() is not None:
+            print("DM queue worker stopped, restarting it:", file=sys.stderr)
+            traceback.print_exception(type(task.exception()), task.exception(), task.exception().__traceback__)
+        self.start()
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def is_closed(self, user_id):
+        until = self.closed.get(user_id)
+        if until is None:
+            return False
+        if until > time.monotonic():
+            return True
+        del self.closed[user_id]
+        return False
+
+    def put(self, user, item):
+        """Queue an item for a user without waiting. Returns False if it was dropped."""
+        if self.is_closed(user.id):
+            return False
+        entry = self.pending.get(user.id)
+        if entry is None:
+            #New users are dropped once the queue is full, existing ones keep coalescing
+            if len(self.pending) >= self.max_pending:
+                self.dropped += 1
+                return False
+            entry = self.pending[user.id] = PendingDM(user, max(time.monotonic(), self.cooldowns.get(user.id, 0)))
+        if len(entry.items) < self.max_items:
+            entry.items.append(item)
+        else:
+            entry.overflow += 1
+        self.queued += 1
+        self.wakeup.set()
+        return True
+
+    async def worker(self):
+        await self.client.wait_until_ready()
+        while not self.client.is_closed():
+            self.wakeup.clear()
+            now = time.monotonic()
+            due = [user_id for user_id, entry in self.pending.items() if entry.due <= now]
+            try:
+                for user_id in due:
+                    await self.deliver(self.pending.pop(user_id))
+                self.prune()
+            except Exception:
+                traceback.print_exc()
+
+            timeout = None
+            if self.pending:
+                timeout = max(0, min(entry.due for entry in self.pending.values()) - time.monotonic())
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def deliver(self, entry):
+        now = time.monotonic()
+        self.cooldowns[entry.user.id] = now + self.cooldown
+        try:
+            await entry.user.send(embed=self.render(entry.items, entry.overflow))
+        except discord.Forbidden:
+            self.closed[entry.user.id] = now + self.closed_ttl
+            self.failed += 1
+        except discord.HTTPException:
+            self.failed += 1
+        except Exception:
+            #Connection errors, timeouts or a bad item in render, only this DM is lost
+            print(f"Could not DM {entry.user.id}:", file=sys.stderr)
+            traceback.print_exc()
+            self.failed += 1
+        else:
+            self.sent += 1
+
+    def prune(self):
+        now = time.monotonic()
+        for table in (self.cooldowns, self.closed):
+            if len(table) > self.max_pending:
+                for user_id in [user_id for user_id, until in table.items() if until <= now]:
+                    del table[user_id]
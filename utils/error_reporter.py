@@ -0,0 +1,100 @@
+import asyncio
+import os
+import time
+import traceback
+import discord
+from collections import deque
+
+
+def fingerprint(error, where):
+    """Group errors by type, the command or event they came from, and the line that raised them."""
+    frames = traceback.extract_tb(error.__traceback__)
+    location = f"{os.path.basename(frames[-1].filename)}:{frames[-1].lineno}" if frames else "-"
+    return (type(error).__name__, where, location)
+
+
+def describe(fingerprint):
+    kind, where, location = fingerprint
+    return f"`{kind}` in {where} ({location})"
+
+
+class ErrorEntry:
+    __slots__ = ("last_seen", "suppressed", "total")
+
+    def __init__(self, now):
+        self.last_seen = now
+        self.suppressed = 0
+        self.total = 1
+
+
+class ErrorReporter:
+    """Posts errors to the bot log without flooding it.
+
+    The first occurrence of a fingerprint is posted straight away. Repeats
+    are only counted, and once every ``window`` seconds one summary lists how
+    often each was repeated. A fingerprint that stays quiet for a whole
+    window is forgotten, so its next occurrence is posted in full again. The
+    last ``history`` tracebacks are kept for the ``.errors`` command.
+    """
+
+    def __init__(self, client, window=300, history=50):
+        self.client = client
+        self.window = window
+        self.entries = {}
+        #(time, fingerprint, formatted traceback), oldest first
+        self.recent = deque(maxlen=history)
+        self.task = None
+        self.posted = 0
+        self.suppressed = 0
+
+    def start(self):
+        if self.task is None:
+            self.task = self.client.loop.create_task(self.worker())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def report(self, error, where, embed):
+        """Record an error, posting ``embed`` if it is the first of its kind this window."""
+        key = fingerprint(error, where)
+        now = time.time()
+        self.recent.append((now, key, "".join(traceback.format_exception(type(error), error, error.__traceback__))))
+        entry = self.entries.get(key)
+        if entry is None:
+            self.entries[key] = ErrorEntry(now)
+            self.client.logSink.send(embed=embed)
+            self.posted += 1
+            return
+        entry.last_seen = now
+        entry.suppressed += 1
+        entry.total += 1
+        self.suppressed += 1
+
+    async def worker(self):
+        while True:
+            await asyncio.sleep(self.window)
+            self.summarise()
+
+    def summarise(self):
+        now = time.time()
+        lines = []
+        for key, entry in list(self.entries.items()):
+            if entry.suppressed:
+                lines.append(f"**×{entry.suppressed}** {describe(key)}")
+                entry.suppressed = 0
+            elif now - entry.last_seen >= self.window:
+                del self.entries[key]
+        if not lines:
+            return
+
+        desc = ""
+        for number, line in enumerate(lines):
+            if len(desc) + len(line) > 1900:
+                desc += f"...and {len(lines) - number} more"
+                break
+            desc += line + "\n"
+        embed=discord.Embed(title=f"Repeated errors in the last {self.window // 60} min", description=desc, color=0xe7ec11)
+        embed.set_footer(text="Only the first of each was posted, use .errors for tracebacks")
+        self.client.logSink.send(embed=embed)
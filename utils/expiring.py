@@ -0,0 +1,39 @@
+import time
+from collections import OrderedDict
+
+
+class ExpiringSet:
+    """Bounded set of keys that each expire after their own TTL.
+
+    Used for cooldowns: ``claim(key, ttl)`` returns False while the key is
+    still active, otherwise marks it active for ``ttl`` seconds. Past
+    ``max_size`` keys the least recently claimed are forgotten first.
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.expiry = OrderedDict()
+
+    def __len__(self):
+        return len(self.expiry)
+
+    def __contains__(self, key):
+        until = self.expiry.get(key)
+        return until is not None and until > time.monotonic()
+
+    def claim(self, key, ttl):
+        now = time.monotonic()
+        until = self.expiry.get(key)
+        if until is not None and until > now:
+            return False
+        self.expiry[key] = now + ttl
+        self.expiry.move_to_end(key)
+        self.evict(now)
+        return True
+
+    def evict(self, now):
+        while self.expiry:
+            key, until = next(iter(self.expiry.items()))
+            if until > now and len(self.expiry) <= self.max_size:
+                break
+            del self.expiry[key]
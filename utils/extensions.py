@@ -0,0 +1,112 @@
+import ast
+import hashlib
+import importlib
+import importlib.util
+import sys
+import time
+import traceback
+from discord.ext import commands
+
+
+#utils modules the client holds objects from (see bot.py), reloading them from a cog
+#would leave two copies of their classes in use, so changes to these need a restart
+SHARED = {
+    "utils.channel_status", "utils.dispatch", "utils.extensions", "utils.log_sink", "utils.matcher",
+    "utils.message_cache", "utils.metrics", "utils.ratelimit", "utils.storage",
+}
+
+
+def source_hash(name):
+    spec = importlib.util.find_spec(name)
+    if spec is None or spec.origin is None:
+        return None
+    with open(spec.origin, "rb") as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+
+def dependencies(name):
+    """Return the ``utils`` modules an extension imports, directly or through each other, outside ``SHARED``."""
+    found = []
+    pending = [name]
+    while pending:
+        spec = importlib.util.find_spec(pending.pop())
+        if spec is None or spec.origin is None:
+            continue
+        with open(spec.origin, "rb") as file:
+            tree = ast.parse(file.read())
+        for node in ast.walk(tree):
+            if isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                modules = [node.module]
+            elif isinstance(node, ast.Import):
+                modules = [alias.name for alias in node.names]
+            else:
+                continue
+            for module in modules:
+                if module.startswith("utils.") and module not in SHARED and module not in found:
+                    found.append(module)
+                    pending.append(module)
+    return found
+
+
+def changed_modules(client, name):
+    """Return the extension and its ``utils`` dependencies whose source changed since they were loaded."""
+    return [module for module in [name] + dependencies(name) if client.cogHashes.get(module) != source_hash(module)]
+
+
+def load_timed(client, name):
+    """Load an extension, recording how long its import and setup took in ``client.cogTimings``."""
+    start = time.perf_counter()
+    try:
+        sources = {module: source_hash(module) for module in [name] + dependencies(name)}
+        client.load_extension(name)
+    except Exception as e:
+        traceback.print_exc()
+        status = type(e).__name__
+    else:
+        status = "Successful"
+        client.cogHashes.update(sources)
+    elapsed = time.perf_counter() - start
+    client.cogTimings[name] = (status, elapsed)
+    return status, elapsed
+
+
+def reload_timed(client, name, force=False):
+    """Reload an extension if its source or a ``utils`` module it uses changed since it was loaded (or ``force`` is set).
+
+    Changed ``utils`` dependencies are reloaded with ``importlib.reload`` before
+    the extension. Otherwise, before unloading, every cog from the extension that
+    defines ``export_state()`` has the result stored under its name in
+    ``client.cogState`` for the new instance to pick up with ``take_state``.
+    That state holds objects built from the old ``utils`` classes, so it is
+    dropped when a dependency changed and the new cog starts fresh.
+    Returns the status and the wall time taken.
+    """
+    stale = changed_modules(client, name)
+    if not force and name in client.extensions and not stale:
+        return "Unchanged", 0.0
+
+    start = time.perf_counter()
+    reloads = [module for module in reversed(dependencies(name)) if module in stale and module in sys.modules]
+    if not reloads:
+        for cog in list(client.cogs.values()):
+            if cog.__module__ == name and hasattr(cog, "export_state"):
+                client.cogState[cog.qualified_name] = cog.export_state()
+    try:
+        client.unload_extension(name)
+    except commands.ExtensionNotLoaded:
+        pass
+    try:
+        for module in reloads:
+            importlib.reload(sys.modules[module])
+    except Exception as e:
+        traceback.print_exc()
+        elapsed = time.perf_counter() - start
+        client.cogTimings[name] = (type(e).__name__, elapsed)
+        return type(e).__name__, elapsed
+    status, _ = load_timed(client, name)
+    return status, time.perf_counter() - start
+
+
+def take_state(client, cog_name):
+    """Return the state a previous instance of a cog handed over on reload, if any."""
+    return getattr(client, "cogState", {}).pop(cog_name, None)
@@ -0,0 +1,20 @@
+import json
+import os
+
+
+def load_json(path, default):
+    """Read a JSON file, returning ``default`` if it is missing, empty or corrupt.
+
+    A corrupt file is moved aside to ``<path>.corrupt`` so it isn't overwritten.
+    """
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return default
+    except ValueError:
+        if os.path.getsize(path):
+            os.replace(path, path + ".corrupt")
+            print(f"Ignoring corrupt JSON file {path}")
+        return default
+
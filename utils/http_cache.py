@@ -0,0 +1,56 @@
+import asyncio
+import datetime
+import time
+from collections import OrderedDict
+
+
+class CoalescingCache:
+    """Keyed TTL cache in front of an async ``fetch(key)``.
+
+    Concurrent lookups of the same key share one in-flight fetch, and when a
+    refresh fails the last good value is served as stale instead of raising.
+    """
+
+    def __init__(self, fetch, ttl=600, max_entries=128):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.max_entries = max_entries
+        #Key -> (expiry, fetched at, value), least recently used first
+        self.entries = OrderedDict()
+        self.inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.stale_served = 0
+
+    async def get(self, key):
+        """Return ``(value, fetched_at, stale)`` for a key."""
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            if entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[2], entry[1], False
+
+        self.misses += 1
+        task = self.inflight.get(key)
+        if task is None:
+            task = self.inflight[key] = asyncio.ensure_future(self.refresh(key))
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        try:
+            #Shielded so one cancelled caller doesn't cancel the fetch for everyone else
+            value, fetched_at = await asyncio.shield(task)
+        except Exception:
+            if entry is None:
+                raise
+            self.stale_served += 1
+            return entry[2], entry[1], True
+        return value, fetched_at, False
+
+    async def refresh(self, key):
+        value = await self.fetch(key)
+        fetched_at = datetime.datetime.now()
+        self.entries[key] = (time.monotonic() + self.ttl, fetched_at, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return value, fetched_at
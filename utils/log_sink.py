@@ -0,0 +1,143 @@
+import asyncio
+import sys
+import traceback
+import discord
+from collections import deque
+from discord.http import Route
+
+#Discord's per-message limits
+MAX_EMBEDS = 10
+MAX_EMBED_CHARS = 6000
+MAX_CONTENT = 2000
+
+
+class LogEntry:
+    __slots__ = ("content", "embed", "files")
+
+    def __init__(self, content, embed, files):
+        self.content = content
+        self.embed = embed
+        self.files = files
+
+
+class LogSink:
+    """Buffers messages for the bot log channel and sends them in batches.
+
+    Embeds are packed up to ten per message and flushed every ``interval``
+    seconds, or straight away once a full message is waiting. Entries with
+    files are sent on their own. Nothing is sent until the optional ``ready``
+    event is set. Past ``max_backlog`` queued entries new ones
+    are dropped and counted, and the count is reported with the next flush.
+    """
+
+    def __init__(self, client, get_channel, interval=2.0, max_backlog=500, ready=None):
+        self.client = client
+        self.get_channel = get_channel
+        self.ready = ready
+        self.interval = interval
+        self.max_backlog = max_backlog
+        self.queue = deque()
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.overflow = 0
+        self.unreported = 0
+        self.sent = 0
+        self.failed = 0
+
+    def start(self):
+        if self.task is None:
+            self.task = self.client.loop.create_task(self.worker())
+            self.task.add_done_callback(self.restart)
+
+    def restart(self, task):
+        #Every cog logs through here, so never let the worker stay dead
+        self.task = None
+        if task.cancelled() or self.client.is_closed():
+            return
+        if task.exception() is not None:
+            print("Log sink worker stopped, restarting it:", file=sys.stderr)
+            traceback.print_exception(type(task.exception()), task.exception(), task.exception().__traceback__)
+        self.start()
+
+    def send(self, content=None, *, embed=None, file=None, files=None):
+        """Queue a log message without waiting. Returns False if the backlog is full."""
+        if len(self.queue) >= self.max_backlog:
+            self.overflow += 1
+            self.unreported += 1
+            return False
+        if file is not None:
+            files = [file]
+        self.queue.append(LogEntry(content, embed, files or None))
+        if files or len(self.queue) >= MAX_EMBEDS:
+            self.wakeup.set()
+        return True
+
+    async def worker(self):
+        await self.client.wait_until_ready()
+        if self.ready is not None:
+            await self.ready.wait()
+        while not self.client.is_closed():
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                traceback.print_exc()
+
+    async def flush(self):
+        channel = self.get_channel()
+        if channel is None:
+            return
+        if self.unreported:
+            self.queue.appendleft(LogEntry(f"{self.unreported} log entries were dropped because the log backlog was full.", None, None))
+            self.unreported = 0
+        while self.queue:
+            queued = len(self.queue)
+            try:
+                if self.queue[0].files is not None:
+                    entry = self.queue.popleft()
+                    await channel.send(content=entry.content, embed=entry.embed, files=entry.files)
+                else:
+                    content, embeds = self.take_batch()
+                    await self.client.http.request(
+                        Route("POST", "/channels/{channel_id}/messages", channel_id=channel.id),
+                        json={"content": content, "embeds": [embed.to_dict() for embed in embeds]},
+                    )
+                self.sent += 1
+            except discord.HTTPException:
+                self.failed += 1
+            except Exception:
+                #Connection errors, timeouts or a malformed entry, drop what was taken and carry on
+                print("Could not send to the bot log:", file=sys.stderr)
+                traceback.print_exc()
+                self.failed += 1
+                if len(self.queue) == queued:
+                    self.queue.popleft()
+
+    def take_batch(self):
+        #Pull consecutive entries until another one would break a message limit
+        lines = []
+        embeds = []
+        content_length = 0
+        embed_chars = 0
+        while self.queue:
+            entry = self.queue[0]
+            if entry.files is not None:
+                break
+            if entry.embed is not None:
+                if len(embeds) == MAX_EMBEDS or (embeds and embed_chars + len(entry.embed) > MAX_EMBED_CHARS):
+                    break
+            if entry.content:
+                if lines and content_length + len(entry.content) + 1 > MAX_CONTENT:
+                    break
+            self.queue.popleft()
+            if entry.embed is not None:
+                embeds.append(entry.embed)
+                embed_chars += len(entry.embed)
+            if entry.content:
+                lines.append(entry.content[:MAX_CONTENT])
+                content_length += len(lines[-1]) + 1
+        return "\n".join(lines) or None, embeds
@@ -0,0 +1,53 @@
+from collections import deque
+
+
+class KeywordMatcher:
+    """Aho-Corasick automaton that finds every registered keyword in one pass over the text."""
+
+    def __init__(self, keywords=()):
+        #Per node: transitions, failure link and the keywords ending here
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [()]
+        for keyword in keywords:
+            self.add(keyword)
+        self.build()
+
+    def add(self, keyword):
+        node = 0
+        for char in keyword:
+            following = self.goto[node].get(char)
+            if following is None:
+                following = len(self.goto)
+                self.goto[node][char] = following
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(())
+            node = following
+        if keyword not in self.output[node]:
+            self.output[node] += (keyword,)
+
+    def build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, following in self.goto[node].items():
+                queue.append(following)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[following] = self.goto[fallback].get(char, 0)
+                self.output[following] += self.output[self.fail[following]]
+
+    def find(self, text):
+        """Return the set of keywords that occur anywhere in ``text``."""
+        found = set()
+        node = 0
+        goto, fail, output = self.goto, self.fail, self.output
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node]:
+                found.update(output[node])
+        return found
@@ -0,0 +1,67 @@
+import sys
+import time
+from collections import OrderedDict
+
+
+class CachedMessage:
+    __slots__ = ("id", "author_id", "channel_id", "content", "attachments", "created")
+
+    def __init__(self, message):
+        self.id = message.id
+        self.author_id = message.author.id
+        self.channel_id = message.channel.id
+        self.content = message.content
+        self.attachments = tuple(attachment.url for attachment in message.attachments)
+        self.created = time.monotonic()
+
+
+class MessageCache:
+    """Bounded cache of compact message records, oldest evicted first.
+
+    Holds at most ``max_messages`` records and forgets any older than
+    ``max_age`` seconds, so deletes and edits of messages that discord.py's own
+    cache has dropped can still be logged from the raw events.
+    """
+
+    def __init__(self, max_messages=10000, max_age=7 * 24 * 3600):
+        self.max_messages = max_messages
+        self.max_age = max_age
+        self.messages = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.messages)
+
+    def add(self, message):
+        self.messages[message.id] = CachedMessage(message)
+        self.evict()
+
+    def get(self, message_id):
+        record = self.messages.get(message_id)
+        if record is None or record.created < time.monotonic() - self.max_age:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return record
+
+    def pop(self, message_id):
+        record = self.get(message_id)
+        self.messages.pop(message_id, None)
+        return record
+
+    def evict(self):
+        expired = time.monotonic() - self.max_age
+        while self.messages:
+            oldest = next(iter(self.messages.values()))
+            if len(self.messages) <= self.max_messages and oldest.created >= expired:
+                break
+            self.messages.popitem(last=False)
+
+    def memory_usage(self):
+        """Approximate bytes held by the records and their index."""
+        total = sys.getsizeof(self.messages)
+        for record in self.messages.values():
+            total += sys.getsizeof(record) + sys.getsizeof(record.content) + sys.getsizeof(record.attachments)
+            total += sum(sys.getsizeof(url) for url in record.attachments)
+        return total
@@ -0,0 +1,161 @@
+import bisect
+import time
+from collections import Counter
+from aiohttp import web
+from utils.ratelimit import RateLimitWatcher
+
+#Histogram bucket upper bounds in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "total", "max", "errors")
+
+    def __init__(self):
+        #One slot per bucket plus the overflow bucket
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.errors = 0
+
+    def observe(self, seconds, error=False):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        if error:
+            self.errors += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the ``q`` quantile, capped at the largest value seen."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Metrics:
+    """Latency histograms and counters for commands, listeners and REST calls.
+
+    ``install`` hooks into the bot once at startup: command before/after
+    invoke hooks, the event runner every listener goes through, the HTTP
+    client's request method and the RateLimitWatcher's reports. Each
+    observation is a dict lookup and a bisect, so it stays on in production.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        #(kind, name) -> Histogram, kind is "command", "listener", "handler" or "api"
+        self.timings = {}
+        #(kind, bucket path) -> rate limits reported by Discord's response headers
+        self.rate_limits = Counter()
+        self.since = time.time()
+
+    def observe(self, kind, name, seconds, error=False):
+        histogram = self.timings.get((kind, name))
+        if histogram is None:
+            histogram = self.timings[kind, name] = Histogram()
+        histogram.observe(seconds, error)
+
+    def top(self, kind, limit=None):
+        """Histograms of one kind, the most total time first."""
+        rows = [(name, histogram) for (k, name), histogram in self.timings.items() if k == kind]
+        rows.sort(key=lambda row: row[1].total, reverse=True)
+        return rows[:limit] if limit else rows
+
+    def install(self, client):
+        client.before_invoke(self.before_command)
+        client.after_invoke(self.after_command)
+        client.add_listener(self.on_command_error)
+
+        run_event = client._run_event
+        async def timed_run_event(coro, event_name, *args, **kwargs):
+            await run_event(self.timed(coro, event_name), event_name, *args, **kwargs)
+        client._run_event = timed_run_event
+
+        request = client.http.request
+        async def timed_request(route, **kwargs):
+            start = time.perf_counter()
+            failed = True
+            try:
+                result = await request(route, **kwargs)
+                failed = False
+                return result
+            finally:
+                self.observe("api", f"{route.method} {route.path}", time.perf_counter() - start, failed)
+        client.http.request = timed_request
+
+        RateLimitWatcher.observe(self.on_rate_limit)
+
+    def timed(self, coro, event_name):
+        name = getattr(coro, "__qualname__", event_name)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            failed = True
+            try:
+                await coro(*args, **kwargs)
+                failed = False
+            finally:
+                self.observe("listener", name, time.perf_counter() - start, failed)
+        return wrapper
+
+    async def before_command(self, ctx):
+        ctx.metrics_start = time.perf_counter()
+
+    async def after_command(self, ctx):
+        self.observe("command", ctx.command.qualified_name, time.perf_counter() - ctx.metrics_start, ctx.command_failed)
+
+    async def on_command_error(self, ctx, error):
+        #Failed checks and bad arguments never reach the invoke hooks, count them without a timing
+        if ctx.command is not None and not hasattr(ctx, "metrics_start"):
+            self.observe("command", ctx.command.qualified_name, 0.0, True)
+
+    def on_rate_limit(self, kind, bucket, seconds):
+        #Buckets look like "channel_id:guild_id:/path/template"
+        path = bucket.split(":", 2)[-1] if bucket else "global"
+        self.rate_limits[kind, path] += 1
+
+    def prometheus(self):
+        lines = [
+            "# TYPE devbot_latency_seconds histogram",
+        ]
+        for (kind, name), histogram in sorted(self.timings.items()):
+            labels = f'kind="{kind}",name="{escape(name)}"'
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram.counts):
+                cumulative += count
+                lines.append(f'devbot_latency_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'devbot_latency_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+            lines.append(f"devbot_latency_seconds_sum{{{labels}}} {histogram.total}")
+            lines.append(f"devbot_latency_seconds_count{{{labels}}} {histogram.count}")
+        lines.append("# TYPE devbot_errors_total counter")
+        for (kind, name), histogram in sorted(self.timings.items()):
+            lines.append(f'devbot_errors_total{{kind="{kind}",name="{escape(name)}"}} {histogram.errors}')
+        lines.append("# TYPE devbot_rate_limits_total counter")
+        for (kind, path), count in sorted(self.rate_limits.items()):
+            lines.append(f'devbot_rate_limits_total{{kind="{kind}",path="{escape(path)}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    async def serve(self, port, host="127.0.0.1"):
+        """Serve ``prometheus()`` at http://host:port/metrics, localhost only by default."""
+        async def handler(request):
+            return web.Response(text=self.prometheus(), content_type="text/plain")
+        app = web.Application()
+        app.router.add_get("/metrics", handler)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        print(f"Metrics on http://{host}:{port}/metrics")
+
+
+def escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -0,0 +1,128 @@
+import asyncio
+import contextvars
+import time
+import weakref
+
+
+class RateLimiter:
+    """Paces a batch of API calls.
+
+    At most ``concurrency`` calls run at once and at most ``rate`` start per
+    second. When Discord reports that a bucket containing ``route`` is
+    exhausted or was rate limited, every caller waits until it resets. Those
+    reports only arrive once ``RateLimitWatcher.install(client)`` has run,
+    which bot.py does at startup.
+    """
+
+    def __init__(self, concurrency=4, rate=5.0, route=None):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.interval = 1 / rate
+        self.route = route
+        self.next_start = 0.0
+        self.paused_until = 0.0
+        self.pauses = 0
+        RateLimitWatcher.watch(self)
+
+    async def __aenter__(self):
+        await self.semaphore.acquire()
+        now = time.monotonic()
+        start = max(now, self.next_start, self.paused_until)
+        self.next_start = start + self.interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    async def __aexit__(self, *exc):
+        self.semaphore.release()
+
+    def pause(self, bucket, seconds):
+        if self.route is None or bucket is None or self.route in bucket:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.pauses += 1
+
+
+class WatchedResponse:
+    """Wraps the context manager ``ClientSession.request`` returns, to look at the response headers."""
+
+    def __init__(self, manager, route):
+        self.manager = manager
+        self.route = route
+
+    async def __aenter__(self):
+        response = await self.manager.__aenter__()
+        RateLimitWatcher.check(self.route, response)
+        return response
+
+    async def __aexit__(self, *exc):
+        return await self.manager.__aexit__(*exc)
+
+
+class RateLimitWatcher:
+    """Reads Discord's rate limit headers off API responses and tells the live RateLimiters and observers.
+
+    ``install`` wraps ``client.http.request`` so the route being called is
+    known when its response arrives on discord.py's aiohttp session. A response emptying its bucket is
+    reported as "exhausted", a 429 as "limited" or, when Discord says it was
+    the global limit, as "global".
+    """
+
+    limiters = weakref.WeakSet()
+    #Callables taking (kind, bucket, seconds)
+    observers = []
+    route = contextvars.ContextVar("rate_limit_route", default=None)
+
+    @classmethod
+    def watch(cls, limiter):
+        cls.limiters.add(limiter)
+
+    @classmethod
+    def observe(cls, callback):
+        cls.observers.append(callback)
+
+    @classmethod
+    def install(cls, client):
+        http = client.http
+        request = http.request
+        async def tracked_request(route, **kwargs):
+            token = cls.track(http, route)
+            try:
+                return await request(route, **kwargs)
+            finally:
+                cls.route.reset(token)
+        http.request = tracked_request
+
+    @classmethod
+    def track(cls, http, route):
+        """Note the route this task is calling, returns a token for ``route.reset``."""
+        #discord.py opens its aiohttp session at login and doesn't expose it
+        session = getattr(http, "_HTTPClient__session", None)
+        if session is not None and not getattr(session.request, "rate_limit_watched", False):
+            request = session.request
+            def watched_request(method, url, **kwargs):
+                return WatchedResponse(request(method, url, **kwargs), cls.route.get())
+            watched_request.rate_limit_watched = True
+            session.request = watched_request
+        return cls.route.set(route)
+
+    @classmethod
+    def check(cls, route, response):
+        headers = response.headers
+        bucket = route.bucket if route is not None else None
+        reset_after = headers.get("X-RateLimit-Reset-After") or headers.get("Retry-After")
+        if response.status == 429:
+            kind = "global" if headers.get("X-RateLimit-Global") else "limited"
+        elif headers.get("X-RateLimit-Remaining") == "0":
+            kind = "exhausted"
+        else:
+            return
+        try:
+            seconds = float(reset_after)
+        except (TypeError, ValueError):
+            return
+        cls.emit(kind, None if kind == "global" else bucket, seconds)
+
+    @classmethod
+    def emit(cls, kind, bucket, seconds):
+        for observer in cls.observers:
+            observer(kind, bucket, seconds)
+        for limiter in list(cls.limiters):
+            limiter.pause(bucket, seconds)
@@ -0,0 +1,124 @@
+import asyncio
+import json
+import random
+import discord
+from utils.expiring import ExpiringSet
+
+SCOPES = ("dm", "channel", "reply")
+#Storage key of the last rule file that loaded, used when the file itself can't be
+LAST_GOOD_KEY = "responder_rules"
+
+
+class Rule:
+    __slots__ = ("name", "trigger", "scope", "response", "cooldown", "per_channel", "group", "edits", "embeds", "channels", "order")
+
+    def __init__(self, spec, order):
+        self.name = spec.get("name", spec["trigger"])
+        self.trigger = spec["trigger"].lower()
+        self.scope = spec.get("scope", "channel")
+        if self.scope not in SCOPES:
+            raise ValueError(f"{self.name}: scope must be one of {', '.join(SCOPES)}")
+        self.response = spec["response"]
+        if not any(key in self.response for key in ("content", "random", "image")):
+            raise ValueError(f"{self.name}: response needs content, random or image")
+        self.cooldown = float(spec.get("cooldown", 0))
+        self.per_channel = spec.get("cooldown_per", "user") == "channel"
+        self.group = spec.get("group", self.name)
+        self.edits = bool(spec.get("edits", False))
+        self.embeds = bool(spec.get("embeds", True))
+        self.channels = frozenset(spec.get("channels", ()))
+        self.order = order
+
+
+class ResponderEngine:
+    """Keyword auto-responses loaded from a JSON rule file.
+
+    Each rule has a ``trigger``, a ``scope`` (dm, channel or reply), a
+    ``response`` (content, a random pick from a list, and/or an image embed)
+    and an optional ``cooldown`` per user or per channel. Rules sharing a
+    ``group`` are exclusive, so only the first matching one in file order
+    responds. All triggers are registered with the bot's MessageRouter, so
+    they are matched by its single automaton.
+    """
+
+    def __init__(self, client, path):
+        self.client = client
+        self.path = path
+        #Trigger -> rules using it, in file order
+        self.rules = {}
+        self.cooldowns = ExpiringSet()
+        self.fired = 0
+        self.suppressed = 0
+
+    def load_specs(self):
+        with open(self.path, encoding="utf-8") as file:
+            return json.load(file)
+
+    async def reload(self):
+        """Load and install the rule file, keeping the current rules if it is invalid."""
+        specs = await asyncio.get_event_loop().run_in_executor(None, self.load_specs)
+        rules = [Rule(spec, order) for order, spec in enumerate(specs)]
+        self.install(rules)
+        self.client.storage.set_value(LAST_GOOD_KEY, specs)
+        return len(rules)
+
+    async def restore(self):
+        """Install the last rule file that loaded, returns how many rules it had."""
+        specs = await self.client.storage.get_value(LAST_GOOD_KEY, [])
+        rules = [Rule(spec, order) for order, spec in enumerate(specs)]
+        self.install(rules)
+        return len(rules)
+
+    def install(self, rules):
+        router = self.client.router
+        router.remove_owner(self, rebuild=False)
+        by_trigger = {}
+        for rule in rules:
+            by_trigger.setdefault(rule.trigger, []).append(rule)
+            router.add_trigger(self, rule.trigger, self.respond, edits=rule.edits, embeds=rule.embeds, rebuild=False)
+        router.rebuild()
+        self.rules = by_trigger
+
+    def close(self):
+        self.client.router.remove_owner(self)
+
+    def all_rules(self):
+        return sorted((rule for rules in self.rules.values() for rule in rules), key=lambda rule: rule.order)
+
+    async def respond(self, prepared, keywords):
+        message = prepared.message
+        candidates = sorted((rule for keyword in keywords for rule in self.rules.get(keyword, ())), key=lambda rule: rule.order)
+        claimed = set()
+        for rule in candidates:
+            if rule.group in claimed:
+                continue
+            if (prepared.edited and not rule.edits) or (prepared.has_embeds and not rule.embeds):
+                continue
+            if rule.channels and message.channel.id not in rule.channels:
+                continue
+            claimed.add(rule.group)
+            key = (rule.name, message.channel.id if rule.per_channel else message.author.id)
+            if rule.cooldown and not self.cooldowns.claim(key, rule.cooldown):
+                self.suppressed += 1
+                continue
+            self.fired += 1
+            await self.send(rule, message)
+
+    async def send(self, rule, message):
+        response = rule.response
+        content = random.choice(response["random"]) if "random" in response else response.get("content")
+        embed = None
+        if "image" in response:
+            embed = discord.Embed()
+            embed.set_image(url=response["image"])
+            if "footer" in response:
+                embed.set_footer(text=response["footer"])
+
+        if rule.scope == "dm":
+            destination = message.author
+        elif rule.scope == "reply":
+            await message.reply(content=content, embed=embed)
+            return
+        else:
+            destination = message.channel
+        await destination.send(content=content, embed=embed)
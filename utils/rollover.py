@@ -0,0 +1,132 @@
+import asyncio
+import discord
+from collections import Counter
+from utils.ratelimit import RateLimiter
+
+#Storage key of the checkpoint of an unfinished run
+CHECKPOINT_KEY = "rollover_checkpoint"
+
+#Seconds between status message edits and checkpoint writes
+REPORT_INTERVAL = 3
+
+
+class RolloverEngine:
+    """Applies a planned set of role changes to a guild's members.
+
+    A plan is a list of ``[member_id, [role IDs to remove], [role IDs to add]]``.
+    Each member is updated with a single role edit by a bounded pool of
+    workers, progress is shown by editing one status message, and finished
+    members are checkpointed in ``storage`` so an interrupted run can resume.
+    """
+
+    def __init__(self, guild, kind, plan, storage, done=(), workers=4):
+        self.guild = guild
+        self.kind = kind
+        self.plan = plan
+        self.storage = storage
+        self.done = set(done)
+        self.failed = 0
+        self.workers = workers
+        self.limiter = RateLimiter(concurrency=workers, rate=5.0, route="/members/")
+
+    @classmethod
+    async def load_checkpoint(cls, guild, storage):
+        checkpoint = await storage.get_value(CHECKPOINT_KEY)
+        if not checkpoint or checkpoint.get("guild") != guild.id:
+            return None
+        return cls(guild, checkpoint["kind"], checkpoint["plan"], storage, checkpoint["done"])
+
+    @staticmethod
+    def clear_checkpoint(storage):
+        storage.delete_value(CHECKPOINT_KEY)
+
+    def summary(self):
+        #Counts of each distinct change, e.g. "First Year -> Second Year: 120"
+        changes = Counter()
+        for member_id, remove, add in self.plan:
+            before = ", ".join(self.role_name(role_id) for role_id in remove)
+            after = ", ".join(self.role_name(role_id) for role_id in add)
+            changes[f"{before} -> {after}"] += 1
+        return changes
+
+    def role_name(self, role_id):
+        role = self.guild.get_role(role_id)
+        return role.name if role else str(role_id)
+
+    def remaining(self):
+        return len(self.plan) - len(self.done)
+
+    def progress(self):
+        return f"Role {self.kind}: {len(self.done)}/{len(self.plan)} members done, {self.failed} failed"
+
+    def save_checkpoint(self):
+        checkpoint = {"guild": self.guild.id, "kind": self.kind, "plan": self.plan, "done": list(self.done)}
+        self.storage.set_value(CHECKPOINT_KEY, checkpoint)
+
+    async def run(self, status):
+        queue = asyncio.Queue()
+        for entry in self.plan:
+            if entry[0] not in self.done:
+                queue.put_nowait(entry)
+        self.save_checkpoint()
+
+        workers = [asyncio.ensure_future(self.worker(queue)) for _ in range(self.workers)]
+        reporter = asyncio.ensure_future(self.report(status))
+        try:
+            await queue.join()
+        finally:
+            for task in workers:
+                task.cancel()
+            reporter.cancel()
+
+        if self.failed:
+            self.save_checkpoint()
+        else:
+            self.clear_checkpoint(self.storage)
+        await status.edit(content=self.progress())
+
+    async def worker(self, queue):
+        while True:
+            member_id, remove, add = await queue.get()
+            try:
+                async with self.limiter:
+                    await self.apply(member_id, remove, add)
+            except discord.HTTPException:
+                self.failed += 1
+            except Exception as e:
+                #Connection errors, timeouts... the member stays out of done so a rerun retries them,
+                #and the worker carries on so queue.join() still returns
+                print(f"Role {self.kind} failed for member {member_id}: {e!r}")
+                self.failed += 1
+            else:
+                self.done.add(member_id)
+            finally:
+                queue.task_done()
+
+    async def apply(self, member_id, remove, add):
+        member = self.guild.get_member(member_id)
+        if member is None:
+            return
+        current = member.roles[1:]
+        roles = [role for role in current if role.id not in remove]
+        for role_id in add:
+            role = self.guild.get_role(role_id)
+            if role is not None and role not in roles:
+                roles.append(role)
+        #Already applied before an interruption
+        if set(roles) == set(current):
+            return
+        await member.edit(roles=roles, reason=f"Academic year {self.kind}")
+
+    async def report(self, status):
+        last = None
+        while True:
+            await asyncio.sleep(REPORT_INTERVAL)
+            progress = self.progress()
+            if progress != last:
+                last = progress
+                self.save_checkpoint()
+                try:
+                    await status.edit(content=progress)
+                except discord.HTTPException:
+                    pass
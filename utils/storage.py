@@ -0,0 +1,293 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from utils.files import load_json
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS highlights (
+    user_id INTEGER NOT NULL,
+    word TEXT NOT NULL,
+    PRIMARY KEY (user_id, word)
+);
+CREATE TABLE IF NOT EXISTS reaction_menus (
+    message_id INTEGER PRIMARY KEY,
+    multiple INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reaction_roles (
+    message_id INTEGER NOT NULL REFERENCES reaction_menus(message_id) ON DELETE CASCADE,
+    emoji TEXT NOT NULL,
+    role_id INTEGER NOT NULL,
+    PRIMARY KEY (message_id, emoji)
+);
+CREATE TABLE IF NOT EXISTS rr_sessions (
+    author_id INTEGER PRIMARY KEY,
+    expires REAL NOT NULL,
+    menu TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS mute_snapshots (
+    guild_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    roles TEXT NOT NULL,
+    muted_at REAL NOT NULL,
+    PRIMARY KEY (guild_id, user_id)
+);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS kv (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS migrations (
+    name TEXT PRIMARY KEY,
+    applied REAL NOT NULL
+);
+"""
+
+
+class Storage:
+    """The bot's state in one SQLite database, in WAL mode.
+
+    All database work runs on one dedicated thread, in the order it was
+    asked for, so the event loop never waits on disk. Writes are queued and
+    committed together in one transaction ``window`` seconds after the first
+    of them (or once ``max_batch`` are waiting); reads flush the queue first
+    so they always see earlier writes. ``close`` commits whatever is left.
+
+    On first open the old JSON files under ``data_dir`` are imported once,
+    see ``MIGRATIONS``. The files are left where they are.
+
+    A batch that fails to commit is retried ``attempts`` times. If it still
+    fails, it is lost and the error is passed to ``log`` on the event loop.
+    """
+
+    def __init__(self, path="data/devbot.db", data_dir="data", window=1.0, max_batch=500, attempts=3, log=None):
+        self.path = path
+        self.data_dir = data_dir
+        self.window = window
+        self.max_batch = max_batch
+        self.attempts = attempts
+        self.log = log
+        self.loop = asyncio.get_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage")
+        self.connection = None
+        self.pending = []
+        self.flush_handle = None
+        self.commits = 0
+        self.writes = 0
+        self.lost = 0
+        self.executor.submit(self._open).add_done_callback(self._report)
+
+    #Running on the storage thread
+
+    def _open(self):
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        #Safe in WAL mode, a power cut can lose the last commits but never corrupts the database
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("PRAGMA foreign_keys=ON")
+        self.connection.executescript(SCHEMA)
+        applied = {name for name, in self.connection.execute("SELECT name FROM migrations")}
+        for name, migrate in MIGRATIONS:
+            if name not in applied:
+                with self.connection:
+                    migrate(self)
+                    self.connection.execute("INSERT INTO migrations VALUES (?, ?)", (name, time.time()))
+                print(f"Storage: applied migration {name}")
+
+    def _commit(self, batch):
+        for attempt in range(1, self.attempts + 1):
+            try:
+                with self.connection:
+                    for statement, params in batch:
+                        self.connection.execute(statement, params)
+            except sqlite3.Error as e:
+                #The transaction was rolled back, so the whole batch can be tried again
+                if attempt == self.attempts:
+                    self.lost += len(batch)
+                    raise RuntimeError(f"{len(batch)} writes lost after {attempt} attempts: {e!r}") from e
+                time.sleep(0.5 * attempt)
+            else:
+                self.commits += 1
+                return
+
+    def _query(self, statement, params):
+        return self.connection.execute(statement, params).fetchall()
+
+    def _close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def _report(self, future):
+        #Runs on the storage thread, so the log is called from the event loop
+        if future.exception() is not None:
+            print(f"Storage error: {future.exception()!r}")
+            if self.log is not None and not self.loop.is_closed():
+                self.loop.call_soon_threadsafe(self.log, f"Storage error: {future.exception()}")
+
+    #Called from the event loop
+
+    def write(self, statement, params=()):
+        """Queue a write without waiting, it is committed within ``window`` seconds."""
+        self.pending.append((statement, params))
+        self.writes += 1
+        if len(self.pending) >= self.max_batch:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = asyncio.get_event_loop().call_later(self.window, self.flush)
+
+    def flush(self):
+        """Hand the queued writes to the storage thread now."""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if self.pending:
+            batch, self.pending = self.pending, []
+            self.executor.submit(self._commit, batch).add_done_callback(self._report)
+
+    async def fetch(self, statement, params=()):
+        self.flush()
+        return await asyncio.get_event_loop().run_in_executor(self.executor, self._query, statement, params)
+
+    def close(self):
+        """Commit everything queued and close the database, waiting for the storage thread."""
+        self.flush()
+        self.executor.submit(self._close)
+        self.executor.shutdown(wait=True)
+
+    #Highlights, user ID -> list of words
+
+    async def load_highlights(self):
+        highlights = {}
+        for user_id, word in await self.fetch("SELECT user_id, word FROM highlights ORDER BY rowid"):
+            highlights.setdefault(str(user_id), []).append(word)
+        return highlights
+
+    def add_highlight(self, user_id, word):
+        self.write("INSERT OR IGNORE INTO highlights VALUES (?, ?)", (int(user_id), word))
+
+    def remove_highlight(self, user_id, word):
+        self.write("DELETE FROM highlights WHERE user_id = ? AND word = ?", (int(user_id), word))
+
+    #Reaction role menus, message ID -> {"multiple": bool, emoji name: role ID}
+
+    async def load_reaction_menus(self):
+        menus = {}
+        for message_id, multiple in await self.fetch("SELECT message_id, multiple FROM reaction_menus"):
+            menus[str(message_id)] = {"multiple": bool(multiple)}
+        for message_id, emoji, role_id in await self.fetch("SELECT message_id, emoji, role_id FROM reaction_roles ORDER BY rowid"):
+            menus[str(message_id)][emoji] = role_id
+        return menus
+
+    def save_reaction_menu(self, message_id, menu):
+        self.write("INSERT OR REPLACE INTO reaction_menus VALUES (?, ?)", (int(message_id), int(menu["multiple"])))
+        for emoji, role_id in menu.items():
+            if emoji != "multiple":
+                self.write("INSERT OR REPLACE INTO reaction_roles VALUES (?, ?, ?)", (int(message_id), emoji, role_id))
+
+    #Unfinished reaction role menus, author ID -> {"expires": timestamp, "menu": settings}
+
+    async def load_sessions(self):
+        rows = await self.fetch("SELECT author_id, expires, menu FROM rr_sessions WHERE expires >= ?", (time.time(),))
+        return {str(author_id): {"expires": expires, "menu": json.loads(menu)} for author_id, expires, menu in rows}
+
+    def save_session(self, author_id, session):
+        self.write("INSERT OR REPLACE INTO rr_sessions VALUES (?, ?, ?)", (int(author_id), session["expires"], json.dumps(session["menu"])))
+
+    def delete_session(self, author_id):
+        self.write("DELETE FROM rr_sessions WHERE author_id = ?", (int(author_id),))
+
+    #Roles members held before .servermute, as a list of role IDs
+
+    async def load_mute_snapshot(self, guild_id, user_id):
+        rows = await self.fetch("SELECT roles FROM mute_snapshots WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
+        return json.loads(rows[0][0]) if rows else None
+
+    def save_mute_snapshot(self, guild_id, user_id, role_ids):
+        self.write("INSERT OR REPLACE INTO mute_snapshots VALUES (?, ?, ?, ?)", (guild_id, user_id, json.dumps(role_ids), time.time()))
+
+    def delete_mute_snapshot(self, guild_id, user_id):
+        self.write("DELETE FROM mute_snapshots WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
+
+    #Named counters
+
+    def increment(self, name, amount=1):
+        self.write("INSERT INTO counters VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value", (name, amount))
+
+    async def counter(self, name):
+        rows = await self.fetch("SELECT value FROM counters WHERE name = ?", (name,))
+        return rows[0][0] if rows else 0
+
+    #Anything else, stored as JSON under a key
+
+    async def get_value(self, key, default=None):
+        rows = await self.fetch("SELECT value FROM kv WHERE key = ?", (key,))
+        return json.loads(rows[0][0]) if rows else default
+
+    def set_value(self, key, value):
+        self.write("INSERT OR REPLACE INTO kv VALUES (?, ?)", (key, json.dumps(value)))
+
+    def delete_value(self, key):
+        self.write("DELETE FROM kv WHERE key = ?", (key,))
+
+
+#One-time imports from the JSON files the cogs used to keep, run in order on the storage thread
+
+def migrate_highlights(storage):
+    path = os.path.join(storage.data_dir, "highlight_data.json")
+    highlights = {}
+    for user_id, words in load_json(path, {}).items():
+        #Older saves hold a single word per user rather than a list
+        highlights[user_id] = [words] if isinstance(words, str) else list(words)
+    #Changes that were still in the journal and not yet folded into the file
+    try:
+        with open(path + ".journal") as file:
+            for line in file:
+                try:
+                    action, user_id, word = json.loads(line)
+                except ValueError:
+                    continue
+                words = highlights.setdefault(user_id, [])
+                if action == "add" and word not in words:
+                    words.append(word)
+                elif action == "remove" and word in words:
+                    words.remove(word)
+    except FileNotFoundError:
+        pass
+    storage.connection.executemany(
+        "INSERT OR IGNORE INTO highlights VALUES (?, ?)",
+        [(int(user_id), word) for user_id, words in highlights.items() for word in words],
+    )
+
+
+def migrate_reaction_menus(storage):
+    for message_id, menu in load_json(os.path.join(storage.data_dir, "reaction_roles_data.json"), {}).items():
+        storage.connection.execute("INSERT OR REPLACE INTO reaction_menus VALUES (?, ?)", (int(message_id), int(menu["multiple"])))
+        storage.connection.executemany(
+            "INSERT OR REPLACE INTO reaction_roles VALUES (?, ?, ?)",
+            [(int(message_id), emoji, role_id) for emoji, role_id in menu.items() if emoji != "multiple"],
+        )
+
+
+def migrate_sessions(storage):
+    for author_id, session in load_json(os.path.join(storage.data_dir, "rr_sessions.json"), {}).items():
+        storage.connection.execute("INSERT OR REPLACE INTO rr_sessions VALUES (?, ?, ?)", (int(author_id), session["expires"], json.dumps(session["menu"])))
+
+
+def migrate_rollover_checkpoint(storage):
+    checkpoint = load_json(os.path.join(storage.data_dir, "rollover_checkpoint.json"), None)
+    if checkpoint:
+        storage.connection.execute("INSERT OR REPLACE INTO kv VALUES (?, ?)", ("rollover_checkpoint", json.dumps(checkpoint)))
+
+
+MIGRATIONS = (
+    ("highlights_json", migrate_highlights),
+    ("reaction_menus_json", migrate_reaction_menus),
+    ("rr_sessions_json", migrate_sessions),
+    ("rollover_checkpoint_json", migrate_rollover_checkpoint),
+)